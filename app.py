@@ -1,24 +1,68 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from typing import Dict, List, Optional
 from passlib.context import CryptContext
-from datetime import datetime, timezone  # Updated import
+from datetime import datetime, timedelta, timezone  # Updated import
+import atexit
+import base64
+import codecs
+import csv
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from bisect import bisect_left, bisect_right, insort
+from itertools import chain, islice
+from urllib.parse import parse_qsl, urlencode
 from typing import Dict, List, Optional
 
-app = FastAPI()
+# Ao subir o servidor, descarta as partes do arquivo histórico de uma execução
+# anterior (ver ArquivoHistorico.limpar). Só o processo que serve a aplicação faz
+# isso; importar o módulo (testes, replay.py) não toca no diretório.
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    arquivo_historico.limpar()
+    yield
+
+app = FastAPI(lifespan=ciclo_de_vida)
+
+# Normaliza datas sem fuso horário para UTC
+def normalizar_data(data: datetime) -> datetime:
+    if data.tzinfo is None:
+        return data.replace(tzinfo=timezone.utc)
+    return data
 
 # Classes fornecidas
 class Produto:
-    def __init__(self, nome, codigo, categoria, quantidade, preco, descricao, fornecedor):
+    def __init__(self, nome, codigo, categoria, quantidade, descricao, fornecedor):
         self.nome = nome
         self.codigo = codigo
         self.categoria = categoria
         self.quantidade = quantidade
-        self.preco = preco
         self.descricao = descricao
         self.fornecedor = fornecedor
 
+    # O preço é o da versão vigente na tabela de preços, inclusive versões agendadas
+    @property
+    def preco(self) -> float:
+        return tabela_precos.preco_vigente(self.codigo)[1]
+
+    # Representação usada nas respostas, com o preço vigente
+    def para_dict(self) -> Dict:
+        return {**vars(self), "preco": self.preco}
+
     def __str__(self):
         return f"{self.nome} ({self.codigo}) - {self.quantidade} unidades em estoque"
 
@@ -29,21 +73,17 @@ class GerenciadorEstoque:
     def cadastrar_produto(self, nome, codigo, categoria, quantidade, preco, descricao, fornecedor):
         if codigo in self.estoque:
             raise ValueError("Código de produto já existe")
-        produto = Produto(nome, codigo, categoria, quantidade, preco, descricao, fornecedor)
+        # O preço é validado e registrado antes de o produto entrar no estoque
+        tabela_precos.registrar_preco(codigo, preco)
+        produto = Produto(nome, codigo, categoria, quantidade, descricao, fornecedor)
         self.estoque[codigo] = produto
+        ranking_vendas.incluir_produto(codigo)
         return produto
 
     def adicionar_estoque(self, codigo, quantidade):
         if codigo in self.estoque:
+            # A movimentação é registrada pelo endpoint, com o usuário autenticado
             self.estoque[codigo].quantidade += quantidade
-            movimentacao = Movimentacao(
-                tipo="adicao",
-                codigo_produto=codigo,
-                quantidade=quantidade,
-                data=datetime.now(timezone.utc),  # Updated
-                usuario="Sistema"  # Pode ser ajustado para registrar o usuário
-            )
-            gerenciador_vendas.movimentacoes.append(movimentacao)
             return self.estoque[codigo]
         else:
             raise ValueError("Produto não encontrado")
@@ -95,8 +135,9 @@ class UsuarioInDB(Usuario):
 class SaleItem(BaseModel):
     codigo: str
     quantidade: int
-    preco_unitario: float
+    preco_unitario: Optional[float] = None  # Ignorado na venda; derivado de versao_preco
     desconto: Optional[float] = 0.0  # Em percentual
+    versao_preco: Optional[int] = None  # Versão da tabela de preços usada na venda
 
 class VendaInput(BaseModel):
     items: List[SaleItem]
@@ -111,12 +152,25 @@ class Venda(BaseModel):
     usuario: str
 
 class Movimentacao(BaseModel):
-    tipo: str  # 'adicao' ou 'remocao'
+    tipo: str  # 'adicao', 'remocao', 'atualizacao' ou 'ajuste' (diferença com sinal)
     codigo_produto: str
     quantidade: int
     data: datetime
     usuario: str
 
+# Modelos Pydantic para preços
+class PrecoInput(BaseModel):
+    preco: float
+    vigencia: Optional[datetime] = None  # Imediata quando omitida
+
+class ReprecificacaoInput(BaseModel):
+    categoria: Optional[str] = None
+    fornecedor: Optional[str] = None
+    codigos: Optional[List[str]] = None
+    modo: str = "percentual"  # 'percentual' ou 'absoluto' (valor somado ao preço)
+    valor: float
+    vigencia: Optional[datetime] = None
+
 # Modelos Pydantic para promoções
 class Promocao(BaseModel):
     codigo: str
@@ -126,6 +180,123 @@ class Promocao(BaseModel):
 # Instância do gerenciador de estoque
 gerenciador = GerenciadorEstoque()
 
+# Tabela de preços versionada: cada versão tem um id sequencial, um preço e uma vigência
+class TabelaPrecos:
+    def __init__(self):
+        self.precos = array("d")
+        self.vigencias: List[datetime] = []
+        # Por produto, a tupla (vigências, versões) em ordem de vigência. A tupla nunca é
+        # alterada: os escritores montam listas novas e trocam a entrada inteira, então
+        # leitores sem lock (vendas no loop de eventos) sempre veem um par consistente
+        self.historicos: Dict[str, tuple] = {}
+        self.lock = threading.Lock()
+        # Incrementado a cada publicação de históricos, sob o lock
+        self.publicacoes = 0
+
+    @staticmethod
+    def _com_versao(historico: Optional[tuple], versao: int, vigencia: datetime) -> tuple:
+        datas, versoes = historico or ([], [])
+        posicao = bisect_right(datas, vigencia)
+        return (
+            datas[:posicao] + [vigencia] + datas[posicao:],
+            versoes[:posicao] + [versao] + versoes[posicao:],
+        )
+
+    def _inserir_versao(self, codigo: str, versao: int, vigencia: datetime):
+        self.historicos[codigo] = self._com_versao(self.historicos.get(codigo), versao, vigencia)
+        self.publicacoes += 1
+
+    def registrar_preco(self, codigo: str, preco: float, vigencia: Optional[datetime] = None) -> int:
+        if preco < 0:
+            raise ValueError("Preço não pode ser negativo.")
+        agora = datetime.now(timezone.utc)
+        vigencia = normalizar_data(vigencia) if vigencia else agora
+        with self.lock:
+            versao = len(self.precos)
+            self.precos.append(preco)
+            self.vigencias.append(vigencia)
+            self._inserir_versao(codigo, versao, vigencia)
+        return versao
+
+    def preco_vigente(self, codigo: str, em: Optional[datetime] = None):
+        historico = self.historicos.get(codigo)
+        if not historico:
+            raise ValueError(f"Produto com código {codigo} não encontrado.")
+        datas, versoes = historico
+        posicao = bisect_right(datas, em or datetime.now(timezone.utc))
+        if posicao == 0:
+            raise ValueError(f"Produto com código {codigo} sem preço vigente.")
+        versao = versoes[posicao - 1]
+        return versao, self.precos[versao]
+
+    def historico(self, codigo: str) -> List[Dict]:
+        if codigo not in self.historicos:
+            raise ValueError("Produto não encontrado")
+        return [
+            {"versao": versao, "preco": self.precos[versao], "vigencia": self.vigencias[versao]}
+            for versao in self.historicos[codigo][1]
+        ]
+
+    # Executada fora do loop de eventos: calcula todos os novos preços em uma passada
+    # e publica as versões de uma vez, sem bloquear as vendas em andamento
+    def reprecificar(self, reprecificacao: ReprecificacaoInput) -> Dict:
+        if reprecificacao.modo not in ("percentual", "absoluto"):
+            raise ValueError("Modo de reprecificação inválido.")
+        if not (reprecificacao.categoria or reprecificacao.fornecedor or reprecificacao.codigos):
+            raise ValueError("Informe categoria, fornecedor ou códigos para reprecificar.")
+        agora = datetime.now(timezone.utc)
+        vigencia = normalizar_data(reprecificacao.vigencia) if reprecificacao.vigencia else agora
+        codigos = set(reprecificacao.codigos) if reprecificacao.codigos else None
+        produtos = [
+            produto for produto in list(gerenciador.estoque.values())
+            if (codigos is None or produto.codigo in codigos)
+            and (reprecificacao.categoria is None or produto.categoria == reprecificacao.categoria)
+            and (reprecificacao.fornecedor is None or produto.fornecedor == reprecificacao.fornecedor)
+        ]
+        # Preço base: o vigente na data da nova versão
+        base = [self.precos[self.preco_vigente(produto.codigo, vigencia)[0]] for produto in produtos]
+        if reprecificacao.modo == "percentual":
+            fator = 1 + reprecificacao.valor / 100
+            novos = [round(preco * fator, 2) for preco in base]
+        else:
+            novos = [round(preco + reprecificacao.valor, 2) for preco in base]
+        if any(preco < 0 for preco in novos):
+            raise ValueError("Reprecificação resultaria em preço negativo.")
+
+        # Os preços entram no array antes de qualquer produto apontar para eles
+        with self.lock:
+            primeira = len(self.precos)
+            self.precos.extend(novos)
+            self.vigencias.extend([vigencia] * len(novos))
+            publicacoes = self.publicacoes
+        # Os novos históricos são montados fora do lock, para não travar quem registra
+        # preços no loop de eventos; o lock volta a ser tomado só para trocá-los
+        versoes = {produto.codigo: primeira + deslocamento for deslocamento, produto in enumerate(produtos)}
+        bases = {codigo: self.historicos.get(codigo) for codigo in versoes}
+        historicos = {codigo: self._com_versao(bases[codigo], versoes[codigo], vigencia) for codigo in versoes}
+        with self.lock:
+            if self.publicacoes != publicacoes:
+                # Outro escritor publicou nesse meio tempo: refaz os produtos que ele alterou
+                for codigo, base in bases.items():
+                    atual = self.historicos.get(codigo)
+                    if atual is not base:
+                        historicos[codigo] = self._com_versao(atual, versoes[codigo], vigencia)
+            self.historicos.update(historicos)
+            self.publicacoes += 1
+        return {
+            "produtos_reprecificados": len(produtos),
+            "primeira_versao": primeira,
+            "vigencia": vigencia,
+        }
+
+tabela_precos = TabelaPrecos()
+
+# Preço unitário de um item de venda, derivado da versão de preço registrada
+def preco_item(item: SaleItem) -> float:
+    if item.versao_preco is None:
+        return item.preco_unitario
+    return tabela_precos.precos[item.versao_preco]
+
 # Instância do gerenciador de vendas
 class VendaInternal:
     def __init__(self, id_venda, data, itens, total, desconto_total, usuario):
@@ -136,11 +307,276 @@ class VendaInternal:
         self.desconto_total = desconto_total
         self.usuario = usuario
 
+# Histórico mais antigo que isso é movido da memória para o arquivo em disco
+DIAS_HISTORICO_QUENTE = 90
+# Intervalo mínimo entre duas verificações automáticas de arquivamento
+INTERVALO_ARQUIVAMENTO_SEGUNDOS = 3600
+EPOCA = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def data_para_micros(data: datetime) -> int:
+    return (normalizar_data(data) - EPOCA) // timedelta(microseconds=1)
+
+def micros_para_data(micros: int) -> datetime:
+    return EPOCA + timedelta(microseconds=micros)
+
+# Arquivo colunar do histórico frio: uma pasta por tabela e mês, com arquivos
+# "parte-NNNNN.col". Cada arquivo tem um cabeçalho JSON com o número de linhas e,
+# por coluna, a posição, o tamanho e os valores mínimo e máximo; cada coluna é
+# uma lista JSON compactada com zlib, lida só quando a consulta precisa dela.
+class ArquivoHistorico:
+    ASSINATURA = b"COL1"
+
+    def __init__(self, diretorio: str):
+        self.diretorio = diretorio
+        # Por tabela, as partes gravadas em ordem cronológica com suas estatísticas
+        self.partes: Dict[str, List[Dict]] = {"vendas": [], "movimentacoes": []}
+
+    # O arquivo é a cauda fria do histórico em memória: produtos, preços e saldos não
+    # sobrevivem a um reinício, então partes de uma execução anterior são descartadas
+    # na inicialização do servidor
+    def limpar(self):
+        for tabela in self.partes:
+            shutil.rmtree(os.path.join(self.diretorio, tabela), ignore_errors=True)
+            self.partes[tabela] = []
+
+    # Grava a parte em disco e devolve suas estatísticas; ela só entra nas consultas
+    # depois de publicada com `publicar`
+    def gravar_parte(self, tabela: str, mes: str, colunas: Dict[str, list]) -> Dict:
+        pasta = os.path.join(self.diretorio, tabela, mes)
+        os.makedirs(pasta, exist_ok=True)
+        caminho = os.path.join(pasta, f"parte-{len(os.listdir(pasta)) + 1:05d}.col")
+        blocos = []
+        cabecalho = {"linhas": len(next(iter(colunas.values()))), "colunas": {}}
+        posicao = 0
+        for nome, valores in colunas.items():
+            bloco = zlib.compress(json.dumps(valores, separators=(",", ":")).encode("utf-8"))
+            escalares = [v for v in valores if v is not None and not isinstance(v, list)]
+            cabecalho["colunas"][nome] = {
+                "posicao": posicao,
+                "tamanho": len(bloco),
+                "min": min(escalares) if escalares else None,
+                "max": max(escalares) if escalares else None,
+            }
+            blocos.append(bloco)
+            posicao += len(bloco)
+        dados_cabecalho = json.dumps(cabecalho).encode("utf-8")
+        with open(caminho, "wb") as arquivo:
+            arquivo.write(self.ASSINATURA)
+            arquivo.write(len(dados_cabecalho).to_bytes(4, "little"))
+            arquivo.write(dados_cabecalho)
+            for bloco in blocos:
+                arquivo.write(bloco)
+        return {"caminho": caminho, "linhas": cabecalho["linhas"], "colunas": cabecalho["colunas"]}
+
+    def publicar(self, tabela: str, partes: List[Dict]):
+        # Uma nova lista, para não alterar fotografias já tiradas das partes
+        self.partes[tabela] = self.partes[tabela] + partes
+
+    def _ler_colunas(self, parte: Dict, nomes: List[str]) -> Dict[str, list]:
+        with open(parte["caminho"], "rb") as arquivo:
+            if arquivo.read(4) != self.ASSINATURA:
+                raise ValueError(f"Arquivo de histórico inválido: {parte['caminho']}")
+            inicio = 8 + int.from_bytes(arquivo.read(4), "little")
+            colunas = {}
+            for nome in nomes:
+                info = parte["colunas"][nome]
+                arquivo.seek(inicio + info["posicao"])
+                colunas[nome] = json.loads(zlib.decompress(arquivo.read(info["tamanho"])))
+        return colunas
+
+    # Percorre as linhas arquivadas; `filtros` mapeia coluna -> (mínimo, máximo), com
+    # None para limite aberto. Partes cujas estatísticas não cruzam os filtros são ignoradas.
+    def consultar(self, tabela: str, colunas: List[str], filtros: Dict[str, tuple], partes: Optional[List[Dict]] = None):
+        filtros = {nome: limites for nome, limites in filtros.items() if limites != (None, None)}
+        for parte in self.partes[tabela] if partes is None else partes:
+            if parte["linhas"] == 0 or not all(
+                self._cruza(parte["colunas"][nome], minimo, maximo) for nome, (minimo, maximo) in filtros.items()
+            ):
+                continue
+            lidas = self._ler_colunas(parte, list(dict.fromkeys(list(filtros) + colunas)))
+            for indice in range(parte["linhas"]):
+                if all(
+                    (minimo is None or lidas[nome][indice] >= minimo) and (maximo is None or lidas[nome][indice] <= maximo)
+                    for nome, (minimo, maximo) in filtros.items()
+                ):
+                    yield tuple(lidas[nome][indice] for nome in colunas)
+
+    @staticmethod
+    def _cruza(estatisticas: Dict, minimo, maximo) -> bool:
+        if estatisticas["min"] is None:
+            return False
+        return (minimo is None or estatisticas["max"] >= minimo) and (maximo is None or estatisticas["min"] <= maximo)
+
+arquivo_historico = ArquivoHistorico(os.environ.get("DIRETORIO_ARQUIVO", "arquivo_historico"))
+
+COLUNAS_ARQUIVO_VENDAS = ["id_venda", "data", "usuario", "total", "desconto_total", "itens"]
+COLUNAS_ARQUIVO_MOVIMENTACOES = ["seq", "tipo", "codigo_produto", "quantidade", "data", "usuario"]
+
+def filtro_datas(data_inicio: Optional[datetime], data_fim: Optional[datetime]) -> tuple:
+    return (
+        data_para_micros(data_inicio) if data_inicio else None,
+        data_para_micros(data_fim) if data_fim else None,
+    )
+
+# Representação de uma venda nos relatórios, com o preço unitário derivado da versão
+def venda_para_dict(venda: VendaInternal) -> Dict:
+    return {
+        "id_venda": venda.id_venda,
+        "data": venda.data,
+        "itens": [
+            {**item.model_dump(), "preco_unitario": preco_item(item)}
+            for item in venda.itens
+        ],
+        "total": venda.total,
+        "desconto_total": venda.desconto_total,
+        "usuario": venda.usuario,
+    }
+
+# Serializa um iterável como uma lista JSON em blocos, para respostas em streaming
+def lista_json(elementos, tamanho_bloco: int = 500):
+    elementos = iter(elementos)
+    yield "["
+    separador = ""
+    for bloco in iter(lambda: list(islice(elementos, tamanho_bloco)), []):
+        yield separador + ",".join(json.dumps(jsonable_encoder(elemento)) for elemento in bloco)
+        separador = ","
+    yield "]"
+
+def venda_arquivada(linha: tuple) -> VendaInternal:
+    id_venda, data, usuario, total, desconto_total, itens = linha
+    return VendaInternal(
+        id_venda=id_venda,
+        data=micros_para_data(data),
+        itens=[
+            SaleItem(codigo=codigo, quantidade=quantidade, desconto=desconto, versao_preco=versao_preco)
+            for codigo, quantidade, desconto, versao_preco in itens
+        ],
+        total=total,
+        desconto_total=desconto_total,
+        usuario=usuario
+    )
+
+def movimentacao_arquivada(linha: tuple) -> Movimentacao:
+    _, tipo, codigo_produto, quantidade, data, usuario = linha
+    return Movimentacao(
+        tipo=tipo,
+        codigo_produto=codigo_produto,
+        quantidade=quantidade,
+        data=micros_para_data(data),
+        usuario=usuario
+    )
+
+# Marca o ponto após as primeiras `indice` movimentações; os saldos ficam em
+# GerenciadorVendas.saldos_checkpoint, gravados só para os produtos alterados
+class CheckpointEstoque:
+    def __init__(self, indice, data):
+        self.indice = indice
+        self.data = data
+
+# Quantidade de movimentações entre dois checkpoints consecutivos
+INTERVALO_CHECKPOINT = 1000
+
+# Aplica uma movimentação ao saldo; 'atualizacao' registra a quantidade absoluta
+def aplicar_movimentacao(saldo: int, movimentacao: Movimentacao) -> int:
+    if movimentacao.tipo == "remocao":
+        return saldo - movimentacao.quantidade
+    if movimentacao.tipo == "atualizacao":
+        return movimentacao.quantidade
+    return saldo + movimentacao.quantidade
+
 class GerenciadorVendas:
     def __init__(self):
         self.vendas: List[VendaInternal] = []
         self.movimentacoes: List[Movimentacao] = []
         self.proximo_id = 1
+        # Saldos reconstruídos a partir das movimentações e checkpoints periódicos
+        self.saldos: Dict[str, int] = {}
+        # Movimentações já movidas para o arquivo; os índices dos checkpoints são absolutos
+        self.movimentacoes_arquivadas = 0
+        self.ultimo_arquivamento = time.monotonic()
+        # Protege o histórico em memória contra o arquivamento, que roda em outra thread
+        self.lock = threading.Lock()
+        # Impede dois arquivamentos simultâneos
+        self.lock_arquivamento = threading.Lock()
+        # Incrementada a cada venda ou movimentação; identifica o estado dos dados
+        self.versao = 0
+        self.checkpoints: List[CheckpointEstoque] = []
+        self.datas_checkpoints: List[datetime] = []
+        # Por produto, os índices dos checkpoints em que o saldo mudou e os saldos nesses pontos
+        self.saldos_checkpoint: Dict[str, tuple] = {}
+        self.alterados_desde_checkpoint = set()
+
+    def registrar_movimentacao(self, movimentacao: Movimentacao):
+        with self.lock:
+            self.movimentacoes.append(movimentacao)
+            self.versao += 1
+            codigo = movimentacao.codigo_produto
+            self.saldos[codigo] = aplicar_movimentacao(self.saldos.get(codigo, 0), movimentacao)
+            self.alterados_desde_checkpoint.add(codigo)
+            total = self.movimentacoes_arquivadas + len(self.movimentacoes)
+            if total % INTERVALO_CHECKPOINT == 0:
+                # Cada checkpoint grava só os produtos alterados desde o anterior
+                for alterado in self.alterados_desde_checkpoint:
+                    indices, saldos = self.saldos_checkpoint.setdefault(alterado, ([], []))
+                    indices.append(total)
+                    saldos.append(self.saldos[alterado])
+                self.alterados_desde_checkpoint = set()
+                checkpoint = CheckpointEstoque(total, movimentacao.data)
+                self.checkpoints.append(checkpoint)
+                self.datas_checkpoints.append(checkpoint.data)
+        self._arquivar_se_necessario()
+
+    def _checkpoint_anterior(self, em: datetime) -> Optional[CheckpointEstoque]:
+        posicao = bisect_right(self.datas_checkpoints, em)
+        return self.checkpoints[posicao - 1] if posicao else None
+
+    def _saldo_no_checkpoint(self, codigo: str, checkpoint: Optional[CheckpointEstoque]) -> int:
+        if checkpoint is None or codigo not in self.saldos_checkpoint:
+            return 0
+        indices, saldos = self.saldos_checkpoint[codigo]
+        posicao = bisect_right(indices, checkpoint.indice)
+        return saldos[posicao - 1] if posicao else 0
+
+    def _movimentacoes_apos(self, checkpoint: Optional[CheckpointEstoque], em: datetime, codigo: Optional[str] = None):
+        inicio = checkpoint.indice if checkpoint else 0
+        if inicio < self.movimentacoes_arquivadas:
+            filtros = {
+                "seq": (inicio, None),
+                "data": (None, data_para_micros(em)),
+                "codigo_produto": (codigo, codigo),
+            }
+            for linha in arquivo_historico.consultar("movimentacoes", COLUNAS_ARQUIVO_MOVIMENTACOES, filtros):
+                yield movimentacao_arquivada(linha)
+            inicio = self.movimentacoes_arquivadas
+        for movimentacao in islice(self.movimentacoes, inicio - self.movimentacoes_arquivadas, None):
+            if movimentacao.data > em:
+                break
+            yield movimentacao
+
+    # As consultas no tempo seguram o lock para que um arquivamento não mova o
+    # histórico entre a leitura do checkpoint e a das movimentações seguintes
+    def estoque_em(self, codigo: str, em: datetime) -> int:
+        with self.lock:
+            checkpoint = self._checkpoint_anterior(em)
+            saldo = self._saldo_no_checkpoint(codigo, checkpoint)
+            for movimentacao in self._movimentacoes_apos(checkpoint, em, codigo):
+                if movimentacao.codigo_produto == codigo:
+                    saldo = aplicar_movimentacao(saldo, movimentacao)
+        return saldo
+
+    def relatorio_estoque_em(self, em: datetime) -> Dict[str, int]:
+        with self.lock:
+            checkpoint = self._checkpoint_anterior(em)
+            saldos = {}
+            if checkpoint:
+                for codigo, (indices, valores) in self.saldos_checkpoint.items():
+                    posicao = bisect_right(indices, checkpoint.indice)
+                    if posicao:
+                        saldos[codigo] = valores[posicao - 1]
+            for movimentacao in self._movimentacoes_apos(checkpoint, em):
+                codigo = movimentacao.codigo_produto
+                saldos[codigo] = aplicar_movimentacao(saldos.get(codigo, 0), movimentacao)
+        return saldos
 
     def registrar_venda(self, venda_input: VendaInput, usuario: str):
         total = 0.0
@@ -150,8 +586,11 @@ class GerenciadorVendas:
                 raise ValueError(f"Produto com código {item.codigo} não encontrado.")
             if produto.quantidade < item.quantidade:
                 raise ValueError(f"Estoque insuficiente para o produto {produto.nome}.")
+            # Guarda só a versão de preço vigente; o preço unitário é derivado dela
+            item.versao_preco, preco = tabela_precos.preco_vigente(item.codigo)
+            item.preco_unitario = None
             # Calcula o total com desconto
-            total += item.quantidade * produto.preco * (1 - item.desconto / 100)
+            total += item.quantidade * preco * (1 - item.desconto / 100)
         
         # Aplica desconto total
         total *= (1 - venda_input.desconto_total / 100)
@@ -166,7 +605,7 @@ class GerenciadorVendas:
                 data=datetime.now(timezone.utc),  # Updated
                 usuario=usuario
             )
-            self.movimentacoes.append(movimentacao)
+            self.registrar_movimentacao(movimentacao)
         
         venda = VendaInternal(
             id_venda=self.proximo_id,
@@ -176,12 +615,23 @@ class GerenciadorVendas:
             desconto_total=venda_input.desconto_total,
             usuario=usuario
         )
-        self.vendas.append(venda)
+        with self.lock:
+            self.vendas.append(venda)
+            self.versao += 1
+        ranking_vendas.registrar_venda(venda)
+        self._arquivar_se_necessario()
         self.proximo_id += 1
         return venda
 
     def gerar_recibo(self, id_venda: int) -> Dict:
-        venda = next((v for v in self.vendas if v.id_venda == id_venda), None)
+        with self.lock:
+            venda = next((v for v in self.vendas if v.id_venda == id_venda), None)
+            partes = arquivo_historico.partes["vendas"]
+        if not venda:
+            linha = next(arquivo_historico.consultar(
+                "vendas", COLUNAS_ARQUIVO_VENDAS, {"id_venda": (id_venda, id_venda)}, partes
+            ), None)
+            venda = venda_arquivada(linha) if linha else None
         if not venda:
             raise ValueError("Venda não encontrada.")
         
@@ -193,9 +643,10 @@ class GerenciadorVendas:
                 {
                     "codigo": item.codigo,
                     "quantidade": item.quantidade,
-                    "preco_unitario": item.preco_unitario,
+                    "preco_unitario": preco_item(item),
+                    "versao_preco": item.versao_preco,
                     "desconto": item.desconto,
-                    "subtotal": round(item.quantidade * item.preco_unitario * (1 - item.desconto / 100), 2)
+                    "subtotal": round(item.quantidade * preco_item(item) * (1 - item.desconto / 100), 2)
                 }
                 for item in venda.itens
             ],
@@ -204,14 +655,656 @@ class GerenciadorVendas:
         }
         return recibo
 
-    def relatorio_vendas(self):
-        return self.vendas
+    # Os relatórios combinam o histórico arquivado em disco com o histórico em memória
+    # Partes arquivadas (a lista é substituída, nunca alterada, ao publicar) e cópia rasa
+    # da lista em memória de uma tabela, para que uma leitura posterior ou fora do loop
+    # de eventos veja um estado consistente
+    def fotografia(self, tabela: str) -> tuple:
+        with self.lock:
+            em_memoria = self.vendas if tabela == "vendas" else self.movimentacoes
+            return arquivo_historico.partes[tabela], list(em_memoria)
+
+    # Os relatórios são geradores sobre uma fotografia tirada na chamada: as linhas
+    # arquivadas são lidas parte a parte, conforme o consumidor avança
+    def relatorio_vendas(self, data_inicio: Optional[datetime] = None, data_fim: Optional[datetime] = None, fotografia: Optional[tuple] = None):
+        partes, em_memoria = fotografia or self.fotografia("vendas")
+        filtros = {"data": filtro_datas(data_inicio, data_fim)}
+        inicio, fim = normalizar_data(data_inicio) if data_inicio else None, normalizar_data(data_fim) if data_fim else None
+        arquivadas = (
+            venda_arquivada(linha)
+            for linha in arquivo_historico.consultar("vendas", COLUNAS_ARQUIVO_VENDAS, filtros, partes)
+        )
+        recentes = (
+            venda for venda in em_memoria
+            if (inicio is None or venda.data >= inicio) and (fim is None or venda.data <= fim)
+        )
+        return chain(arquivadas, recentes)
+
+    def relatorio_movimentacoes(self, data_inicio: Optional[datetime] = None, data_fim: Optional[datetime] = None, fotografia: Optional[tuple] = None):
+        partes, em_memoria = fotografia or self.fotografia("movimentacoes")
+        filtros = {"data": filtro_datas(data_inicio, data_fim)}
+        inicio, fim = normalizar_data(data_inicio) if data_inicio else None, normalizar_data(data_fim) if data_fim else None
+        arquivadas = (
+            movimentacao_arquivada(linha)
+            for linha in arquivo_historico.consultar("movimentacoes", COLUNAS_ARQUIVO_MOVIMENTACOES, filtros, partes)
+        )
+        recentes = (
+            movimentacao for movimentacao in em_memoria
+            if (inicio is None or movimentacao.data >= inicio) and (fim is None or movimentacao.data <= fim)
+        )
+        return chain(arquivadas, recentes)
+
+    # O arquivamento periódico roda numa thread, fora da requisição que cruzou o intervalo
+    def _arquivar_se_necessario(self):
+        if time.monotonic() - self.ultimo_arquivamento < INTERVALO_ARQUIVAMENTO_SEGUNDOS:
+            return
+        if self.lock_arquivamento.locked():
+            return
+        self.ultimo_arquivamento = time.monotonic()
+        threading.Thread(target=self.arquivar, daemon=True).start()
+
+    # Move vendas e movimentações anteriores a `corte` para o arquivo, uma parte por mês.
+    # Os arquivos são gravados sem o lock; ele só é tomado para copiar o trecho a arquivar
+    # e, no fim, para publicar as partes e remover esse trecho da memória.
+    def arquivar(self, corte: Optional[datetime] = None) -> Dict:
+        with self.lock_arquivamento:
+            return self._arquivar(corte)
+
+    def _arquivar(self, corte: Optional[datetime]) -> Dict:
+        self.ultimo_arquivamento = time.monotonic()
+        corte = normalizar_data(corte) if corte else datetime.now(timezone.utc) - timedelta(days=DIAS_HISTORICO_QUENTE)
+
+        with self.lock:
+            quantidade_vendas = 0
+            while quantidade_vendas < len(self.vendas) and self.vendas[quantidade_vendas].data < corte:
+                quantidade_vendas += 1
+            vendas = self.vendas[:quantidade_vendas]
+            quantidade_movimentacoes = 0
+            while (quantidade_movimentacoes < len(self.movimentacoes)
+                   and self.movimentacoes[quantidade_movimentacoes].data < corte):
+                quantidade_movimentacoes += 1
+            movimentacoes = self.movimentacoes[:quantidade_movimentacoes]
+            primeira_seq = self.movimentacoes_arquivadas
+
+        por_mes: Dict[str, Dict[str, list]] = {}
+        for venda in vendas:
+            colunas = por_mes.setdefault(venda.data.strftime("%Y-%m"), {nome: [] for nome in COLUNAS_ARQUIVO_VENDAS})
+            colunas["id_venda"].append(venda.id_venda)
+            colunas["data"].append(data_para_micros(venda.data))
+            colunas["usuario"].append(venda.usuario)
+            colunas["total"].append(venda.total)
+            colunas["desconto_total"].append(venda.desconto_total)
+            colunas["itens"].append([
+                [item.codigo, item.quantidade, item.desconto, item.versao_preco]
+                for item in venda.itens
+            ])
+        partes_vendas = [
+            arquivo_historico.gravar_parte("vendas", mes, colunas) for mes, colunas in por_mes.items()
+        ]
+
+        por_mes = {}
+        for deslocamento, movimentacao in enumerate(movimentacoes):
+            colunas = por_mes.setdefault(movimentacao.data.strftime("%Y-%m"), {nome: [] for nome in COLUNAS_ARQUIVO_MOVIMENTACOES})
+            colunas["seq"].append(primeira_seq + deslocamento)
+            colunas["tipo"].append(movimentacao.tipo)
+            colunas["codigo_produto"].append(movimentacao.codigo_produto)
+            colunas["quantidade"].append(movimentacao.quantidade)
+            colunas["data"].append(data_para_micros(movimentacao.data))
+            colunas["usuario"].append(movimentacao.usuario)
+        partes_movimentacoes = [
+            arquivo_historico.gravar_parte("movimentacoes", mes, colunas) for mes, colunas in por_mes.items()
+        ]
 
-    def relatorio_movimentacoes(self):
-        return self.movimentacoes
+        with self.lock:
+            # Vendas e movimentações novas só entram no fim das listas, então o trecho
+            # copiado continua sendo o prefixo delas
+            arquivo_historico.publicar("vendas", partes_vendas)
+            del self.vendas[:quantidade_vendas]
+            arquivo_historico.publicar("movimentacoes", partes_movimentacoes)
+            del self.movimentacoes[:quantidade_movimentacoes]
+            self.movimentacoes_arquivadas += quantidade_movimentacoes
+            self._podar_checkpoints(corte)
+
+        return {
+            "corte": corte,
+            "vendas_arquivadas": quantidade_vendas,
+            "movimentacoes_arquivadas": quantidade_movimentacoes,
+        }
+
+    # Antes do corte basta um checkpoint por mês; o restante é reconstruído do arquivo
+    def _podar_checkpoints(self, corte: datetime):
+        checkpoints = []
+        for checkpoint in self.checkpoints:
+            if (checkpoints and checkpoints[-1].data < corte
+                    and checkpoints[-1].data.strftime("%Y-%m") == checkpoint.data.strftime("%Y-%m")
+                    and checkpoint.data < corte):
+                checkpoints[-1] = checkpoint
+            else:
+                checkpoints.append(checkpoint)
+        self.checkpoints = checkpoints
+        self.datas_checkpoints = [checkpoint.data for checkpoint in checkpoints]
+        # De cada produto basta o último saldo anterior a cada checkpoint mantido
+        indices_mantidos = [checkpoint.indice for checkpoint in checkpoints]
+        for codigo, (indices, saldos) in self.saldos_checkpoint.items():
+            novos_indices, novos_saldos, grupos = [], [], []
+            for indice, saldo in zip(indices, saldos):
+                grupo = bisect_left(indices_mantidos, indice)
+                if grupos and grupos[-1] == grupo:
+                    novos_indices[-1], novos_saldos[-1] = indice, saldo
+                else:
+                    grupos.append(grupo)
+                    novos_indices.append(indice)
+                    novos_saldos.append(saldo)
+            self.saldos_checkpoint[codigo] = (novos_indices, novos_saldos)
 
 gerenciador_vendas = GerenciadorVendas()
 
+# Janelas deslizantes disponíveis para os rankings, em segundos
+JANELAS_RANKING = {"1h": 3600, "24h": 86400, "7d": 7 * 86400, "30d": 30 * 86400}
+# Largura de cada balde de agregação, em segundos
+RESOLUCAO_RANKING = 60
+# Maior número de produtos devolvido por um ranking
+MAX_N_RANKING = 100
+# Participação acumulada que delimita as classes A e B da curva ABC
+LIMITES_ABC = {"A": 0.80, "B": 0.95}
+METRICAS_RANKING = {"unidades": 0, "receita": 1}
+
+# Produtos ordenados pelo valor de uma métrica, em blocos ordenados de até 2 * CARGA
+# chaves (valor, codigo). Atualizar um produto custa uma busca binária e um deslocamento
+# dentro de um bloco; cada bloco guarda a soma dos seus valores para a curva ABC.
+class OrdemRanking:
+    CARGA = 512
+
+    def __init__(self):
+        self.blocos: List[List[tuple]] = []
+        self.somas: List[float] = []
+        self.maximos: List[tuple] = []
+        self.tamanho = 0
+
+    def __len__(self):
+        return self.tamanho
+
+    def inserir(self, chave: tuple):
+        self.tamanho += 1
+        if not self.blocos:
+            self.blocos.append([chave])
+            self.somas.append(chave[0])
+            self.maximos.append(chave)
+            return
+        posicao = min(bisect_left(self.maximos, chave), len(self.blocos) - 1)
+        bloco = self.blocos[posicao]
+        insort(bloco, chave)
+        self.somas[posicao] += chave[0]
+        self.maximos[posicao] = bloco[-1]
+        if len(bloco) > 2 * self.CARGA:
+            metade = bloco[self.CARGA:]
+            del bloco[self.CARGA:]
+            self.blocos.insert(posicao + 1, metade)
+            self.somas[posicao] = sum(valor for valor, _ in bloco)
+            self.somas.insert(posicao + 1, sum(valor for valor, _ in metade))
+            self.maximos[posicao] = bloco[-1]
+            self.maximos.insert(posicao + 1, metade[-1])
+
+    def remover(self, chave: tuple):
+        posicao = bisect_left(self.maximos, chave)
+        bloco = self.blocos[posicao]
+        del bloco[bisect_left(bloco, chave)]
+        self.tamanho -= 1
+        if bloco:
+            self.somas[posicao] -= chave[0]
+            self.maximos[posicao] = bloco[-1]
+        else:
+            del self.blocos[posicao], self.somas[posicao], self.maximos[posicao]
+
+    def total(self) -> float:
+        return sum(self.somas)
+
+    def crescente(self):
+        for bloco in self.blocos:
+            yield from bloco
+
+    def decrescente(self):
+        for bloco in reversed(self.blocos):
+            yield from reversed(bloco)
+
+    # Quantos produtos, em ordem decrescente, têm participação acumulada anterior abaixo do limite
+    def contar_ate(self, limite: float) -> int:
+        contagem = 0
+        acumulado = 0.0
+        for bloco, soma in zip(reversed(self.blocos), reversed(self.somas)):
+            if acumulado + soma < limite:
+                contagem += len(bloco)
+                acumulado += soma
+                continue
+            for valor, _ in reversed(bloco):
+                if acumulado >= limite:
+                    return contagem
+                contagem += 1
+                acumulado += valor
+            return contagem
+        return contagem
+
+# Totais de vendas por produto em janelas deslizantes, mantidos a cada venda.
+# As vendas são agregadas em baldes de RESOLUCAO_RANKING segundos; cada janela soma
+# os baldes que ainda cobre e subtrai os que saem dela. Para cada janela e métrica os
+# produtos vendidos ficam ordenados (OrdemRanking), e os produtos do catálogo sem venda
+# na janela ficam à parte, de modo que rankings e curva ABC não percorrem o catálogo.
+class RankingVendas:
+    def __init__(self):
+        self.ultimo_balde = 0
+        self.baldes: Dict[str, deque] = {janela: deque() for janela in JANELAS_RANKING}
+        self.totais: Dict[str, Dict[str, List[float]]] = {janela: {} for janela in JANELAS_RANKING}
+        self.ordens: Dict[str, List[OrdemRanking]] = {
+            janela: [OrdemRanking() for _ in METRICAS_RANKING] for janela in JANELAS_RANKING
+        }
+        self.sem_vendas: Dict[str, Dict[str, None]] = {janela: {} for janela in JANELAS_RANKING}
+
+    def incluir_produto(self, codigo: str):
+        for janela in JANELAS_RANKING:
+            if codigo not in self.totais[janela]:
+                self.sem_vendas[janela][codigo] = None
+
+    def _atualizar_ordens(self, janela: str, codigo: str, antigo: Optional[tuple], novo: Optional[tuple]):
+        for indice, ordem in enumerate(self.ordens[janela]):
+            if antigo is not None:
+                ordem.remover((antigo[indice], codigo))
+            if novo is not None:
+                ordem.inserir((novo[indice], codigo))
+
+    def _avancar(self, balde_atual: int):
+        self.ultimo_balde = max(self.ultimo_balde, balde_atual)
+        for janela, segundos in JANELAS_RANKING.items():
+            limite = self.ultimo_balde - segundos // RESOLUCAO_RANKING
+            baldes, totais = self.baldes[janela], self.totais[janela]
+            while baldes and baldes[0][0] <= limite:
+                _, valores = baldes.popleft()
+                for codigo, (unidades, receita) in valores.items():
+                    total = totais[codigo]
+                    antigo = tuple(total)
+                    total[0] -= unidades
+                    total[1] -= receita
+                    if total[0] <= 0:
+                        del totais[codigo]
+                        self._atualizar_ordens(janela, codigo, antigo, None)
+                        if codigo in gerenciador.estoque:
+                            self.sem_vendas[janela][codigo] = None
+                    else:
+                        self._atualizar_ordens(janela, codigo, antigo, tuple(total))
+
+    def registrar(self, data: datetime, codigo: str, unidades: int, receita: float):
+        self._avancar(int(data.timestamp()) // RESOLUCAO_RANKING)
+        balde = None
+        for janela in JANELAS_RANKING:
+            baldes = self.baldes[janela]
+            if not baldes or baldes[-1][0] != self.ultimo_balde:
+                # O mesmo dicionário de balde é compartilhado por todas as janelas
+                balde = balde or (self.ultimo_balde, {})
+                baldes.append(balde)
+            balde = baldes[-1]
+            totais = self.totais[janela].get(codigo)
+            if totais is None:
+                totais = self.totais[janela][codigo] = [0, 0.0]
+                self.sem_vendas[janela].pop(codigo, None)
+                antigo = None
+            else:
+                antigo = tuple(totais)
+            totais[0] += unidades
+            totais[1] += receita
+            self._atualizar_ordens(janela, codigo, antigo, tuple(totais))
+        valores = balde[1].setdefault(codigo, [0, 0.0])
+        valores[0] += unidades
+        valores[1] += receita
+
+    def registrar_venda(self, venda: VendaInternal):
+        for item in venda.itens:
+            receita = item.quantidade * preco_item(item) * (1 - item.desconto / 100) * (1 - venda.desconto_total / 100)
+            self.registrar(venda.data, item.codigo, item.quantidade, receita)
+
+    @staticmethod
+    def _validar(janela: str, metrica: str):
+        if janela not in JANELAS_RANKING:
+            raise ValueError(f"Janela inválida. Use uma de: {', '.join(JANELAS_RANKING)}.")
+        if metrica not in METRICAS_RANKING:
+            raise ValueError("Métrica inválida. Use 'unidades' ou 'receita'.")
+
+    def _ordem(self, janela: str, metrica: str) -> OrdemRanking:
+        self._validar(janela, metrica)
+        # Descarta os baldes que saíram das janelas desde a última venda
+        self._avancar(int(datetime.now(timezone.utc).timestamp()) // RESOLUCAO_RANKING)
+        return self.ordens[janela][METRICAS_RANKING[metrica]]
+
+    def top(self, janela: str, metrica: str, n: int, ordem: str) -> List[Dict]:
+        if ordem not in ("melhores", "piores"):
+            raise ValueError("Ordem inválida. Use 'melhores' ou 'piores'.")
+        if not 1 <= n <= MAX_N_RANKING:
+            raise ValueError(f"n deve estar entre 1 e {MAX_N_RANKING}.")
+        ordenados = self._ordem(janela, metrica)
+        if ordem == "melhores":
+            selecionados = [codigo for _, codigo in islice(ordenados.decrescente(), n)]
+        else:
+            # Os piores começam pelos produtos do catálogo sem nenhuma venda na janela
+            selecionados = list(islice(self.sem_vendas[janela], n))
+            if len(selecionados) < n:
+                vendidos = (codigo for _, codigo in ordenados.crescente() if codigo in gerenciador.estoque)
+                selecionados.extend(islice(vendidos, n - len(selecionados)))
+        totais = self.totais[janela]
+        vazio = (0, 0.0)
+        return [
+            {
+                "codigo": codigo,
+                "unidades": totais.get(codigo, vazio)[0],
+                "receita": round(totais.get(codigo, vazio)[1], 2),
+            }
+            for codigo in selecionados
+        ]
+
+    # Tamanho de cada classe ABC; a classe é definida pela participação acumulada antes do produto
+    def curva_abc(self, janela: str, metrica: str) -> Dict[str, int]:
+        ordenados = self._ordem(janela, metrica)
+        total_geral = ordenados.total()
+        limite_a = ordenados.contar_ate(LIMITES_ABC["A"] * total_geral)
+        limite_b = ordenados.contar_ate(LIMITES_ABC["B"] * total_geral)
+        return {
+            "A": limite_a,
+            "B": limite_b - limite_a,
+            "C": len(ordenados) - limite_b + len(self.sem_vendas[janela]),
+        }
+
+    def produtos_abc(self, janela: str, metrica: str, classe: str) -> List[str]:
+        if classe not in LIMITES_ABC and classe != "C":
+            raise ValueError("Classe inválida. Use 'A', 'B' ou 'C'.")
+        resumo = self.curva_abc(janela, metrica)
+        ordenados = self.ordens[janela][METRICAS_RANKING[metrica]]
+        inicio = {"A": 0, "B": resumo["A"], "C": resumo["A"] + resumo["B"]}[classe]
+        fim = None if classe == "C" else inicio + resumo[classe]
+        produtos = [codigo for _, codigo in islice(ordenados.decrescente(), inicio, fim)]
+        if classe == "C":
+            produtos.extend(self.sem_vendas[janela])
+        return produtos
+
+ranking_vendas = RankingVendas()
+
+# Sessões de inventário físico (contagem de estoque)
+class SessaoInventario:
+    def __init__(self, id_sessao, data_abertura, usuario):
+        self.id_sessao = id_sessao
+        self.data_abertura = data_abertura
+        self.usuario = usuario
+        self.status = "aberta"  # 'aberta' ou 'fechada'
+        self.data_fechamento: Optional[datetime] = None
+        # Quantidades contadas por produto; contagens de vários leitores são somadas
+        self.contagens: Dict[str, int] = {}
+        self.linhas_recebidas = 0
+
+    def resumo(self) -> Dict:
+        return {
+            "id_sessao": self.id_sessao,
+            "status": self.status,
+            "usuario": self.usuario,
+            "data_abertura": self.data_abertura,
+            "data_fechamento": self.data_fechamento,
+            "linhas_recebidas": self.linhas_recebidas,
+            "produtos_contados": len(self.contagens),
+        }
+
+class GerenciadorInventario:
+    def __init__(self):
+        self.sessoes: Dict[int, SessaoInventario] = {}
+        self.proximo_id = 1
+
+    def abrir_sessao(self, usuario: str) -> SessaoInventario:
+        sessao = SessaoInventario(self.proximo_id, datetime.now(timezone.utc), usuario)
+        self.sessoes[sessao.id_sessao] = sessao
+        self.proximo_id += 1
+        return sessao
+
+    def obter_sessao(self, id_sessao: int) -> SessaoInventario:
+        sessao = self.sessoes.get(id_sessao)
+        if not sessao:
+            raise ValueError("Sessão de inventário não encontrada.")
+        return sessao
+
+    def registrar_contagens(self, id_sessao: int, contagens: Dict[str, int], linhas: int) -> SessaoInventario:
+        # As contagens de um lote só são incorporadas se todo o lote for válido
+        sessao = self.obter_sessao(id_sessao)
+        if sessao.status != "aberta":
+            raise ValueError("Sessão de inventário já foi fechada.")
+        desconhecidos = [codigo for codigo in contagens if codigo not in gerenciador.estoque]
+        if desconhecidos:
+            raise ValueError(f"Produtos não encontrados: {', '.join(desconhecidos[:10])}")
+        for codigo, quantidade in contagens.items():
+            sessao.contagens[codigo] = sessao.contagens.get(codigo, 0) + quantidade
+        sessao.linhas_recebidas += linhas
+        return sessao
+
+    def fechar_sessao(self, id_sessao: int, usuario: str) -> Dict:
+        sessao = self.obter_sessao(id_sessao)
+        if sessao.status != "aberta":
+            raise ValueError("Sessão de inventário já foi fechada.")
+        estoque = gerenciador.estoque
+        # Primeira passada: calcula todas as diferenças sem alterar o estoque
+        diferencas = {}
+        for codigo, contado in sessao.contagens.items():
+            produto = estoque.get(codigo)
+            if not produto:
+                raise ValueError(f"Produto com código {codigo} não encontrado.")
+            if contado < 0:
+                raise ValueError(f"Contagem negativa para o produto {codigo}.")
+            diferenca = contado - produto.quantidade
+            if diferenca:
+                diferencas[codigo] = diferenca
+        # Segunda passada: aplica os ajustes e registra movimentações com sinal
+        data = datetime.now(timezone.utc)
+        for codigo, diferenca in diferencas.items():
+            estoque[codigo].quantidade += diferenca
+            movimentacao = Movimentacao(
+                tipo="ajuste",
+                codigo_produto=codigo,
+                quantidade=diferenca,
+                data=data,
+                usuario=usuario
+            )
+            gerenciador_vendas.registrar_movimentacao(movimentacao)
+        sessao.status = "fechada"
+        sessao.data_fechamento = data
+        resumo = sessao.resumo()
+        resumo["produtos_ajustados"] = len(diferencas)
+        resumo["ajuste_positivo"] = sum(d for d in diferencas.values() if d > 0)
+        resumo["ajuste_negativo"] = sum(d for d in diferencas.values() if d < 0)
+        return resumo
+
+gerenciador_inventario = GerenciadorInventario()
+
+# Exportações de relatórios executadas em segundo plano
+class ExportacaoInput(BaseModel):
+    tipo: str  # 'vendas' ou 'movimentacoes'
+    formato: str = "csv"  # 'csv' ou 'json'
+    data_inicio: Optional[datetime] = None
+    data_fim: Optional[datetime] = None
+    usuario: Optional[str] = None
+    codigo_produto: Optional[str] = None
+
+COLUNAS_EXPORTACAO = {
+    "vendas": ["id_venda", "data", "usuario", "codigo", "quantidade", "preco_unitario", "versao_preco", "desconto", "desconto_total", "total"],
+    "movimentacoes": ["tipo", "codigo_produto", "quantidade", "data", "usuario"],
+}
+
+# Número máximo de processos usados para serializar exportações
+MAX_PROCESSOS_EXPORTACAO = 2
+# Quantidade de arquivos de exportação mantidos em cache
+LIMITE_CACHE_EXPORTACOES = 32
+
+# Executada em um processo separado: grava as linhas no arquivo de saída
+def gerar_arquivo_exportacao(caminho: str, formato: str, colunas: List[str], linhas: List[tuple]) -> int:
+    with open(caminho, "w", newline="", encoding="utf-8") as arquivo:
+        if formato == "json":
+            json.dump([dict(zip(colunas, linha)) for linha in linhas], arquivo, ensure_ascii=False)
+        else:
+            escritor = csv.writer(arquivo)
+            escritor.writerow(colunas)
+            escritor.writerows(linhas)
+    return os.path.getsize(caminho)
+
+class JobExportacao:
+    def __init__(self, id_job, exportacao: ExportacaoInput, versao, usuario):
+        self.id_job = id_job
+        self.exportacao = exportacao
+        self.versao = versao
+        self.usuario = usuario
+        self.criado_em = datetime.now(timezone.utc)
+        self.concluido_em: Optional[datetime] = None
+        self.caminho: Optional[str] = None
+        self.tamanho: Optional[int] = None
+        self.erro: Optional[str] = None
+        self.expirado = False
+        self.futuro = None
+
+    @property
+    def status(self) -> str:
+        if self.expirado:
+            return "expirado"
+        if self.erro:
+            return "erro"
+        if self.concluido_em:
+            return "concluido"
+        if self.futuro and self.futuro.running():
+            return "executando"
+        return "pendente"
+
+    def resumo(self) -> Dict:
+        return {
+            "id_job": self.id_job,
+            "status": self.status,
+            "tipo": self.exportacao.tipo,
+            "formato": self.exportacao.formato,
+            "versao_dados": self.versao,
+            "usuario": self.usuario,
+            "criado_em": self.criado_em,
+            "concluido_em": self.concluido_em,
+            "tamanho": self.tamanho,
+            "erro": self.erro,
+        }
+
+class GerenciadorExportacoes:
+    def __init__(self):
+        self.jobs: Dict[int, JobExportacao] = {}
+        # Chave (parâmetros da exportação, versão dos dados) -> job que gerou o arquivo
+        self.cache: "OrderedDict[tuple, JobExportacao]" = OrderedDict()
+        self.proximo_id = 1
+        self.pool: Optional[ProcessPoolExecutor] = None
+        # Threads que selecionam as linhas e aguardam a serialização no pool de processos
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.diretorio: Optional[str] = None
+
+    def _linhas(self, exportacao: ExportacaoInput, fotografia: tuple) -> List[tuple]:
+        inicio = normalizar_data(exportacao.data_inicio) if exportacao.data_inicio else None
+        fim = normalizar_data(exportacao.data_fim) if exportacao.data_fim else None
+
+        def no_periodo(data):
+            return (inicio is None or data >= inicio) and (fim is None or data <= fim)
+
+        linhas = []
+        if exportacao.tipo == "vendas":
+            for venda in gerenciador_vendas.relatorio_vendas(inicio, fim, fotografia):
+                if not no_periodo(venda.data) or (exportacao.usuario and venda.usuario != exportacao.usuario):
+                    continue
+                for item in venda.itens:
+                    if exportacao.codigo_produto and item.codigo != exportacao.codigo_produto:
+                        continue
+                    linhas.append((
+                        venda.id_venda, venda.data.isoformat(), venda.usuario, item.codigo, item.quantidade,
+                        preco_item(item), item.versao_preco, item.desconto, venda.desconto_total, round(venda.total, 2)
+                    ))
+        else:
+            for movimentacao in gerenciador_vendas.relatorio_movimentacoes(inicio, fim, fotografia):
+                if not no_periodo(movimentacao.data) or (exportacao.usuario and movimentacao.usuario != exportacao.usuario):
+                    continue
+                if exportacao.codigo_produto and movimentacao.codigo_produto != exportacao.codigo_produto:
+                    continue
+                linhas.append((
+                    movimentacao.tipo, movimentacao.codigo_produto, movimentacao.quantidade,
+                    movimentacao.data.isoformat(), movimentacao.usuario
+                ))
+        return linhas
+
+    # Executada em uma thread: seleciona as linhas e serializa o arquivo em outro processo
+    def _executar(self, job: JobExportacao, fotografia: tuple) -> int:
+        exportacao = job.exportacao
+        linhas = self._linhas(exportacao, fotografia)
+        return self.pool.submit(
+            gerar_arquivo_exportacao, job.caminho, exportacao.formato, COLUNAS_EXPORTACAO[exportacao.tipo], linhas
+        ).result()
+
+    def _concluir(self, job: JobExportacao, futuro):
+        try:
+            job.tamanho = futuro.result()
+            job.concluido_em = datetime.now(timezone.utc)
+        except Exception as e:
+            job.erro = str(e) or e.__class__.__name__
+        # Removido do cache enquanto executava: o arquivo não será mais servido
+        if job.expirado:
+            self._remover_arquivo(job)
+
+    @staticmethod
+    def _remover_arquivo(job: JobExportacao):
+        try:
+            os.remove(job.caminho)
+        except FileNotFoundError:
+            pass
+
+    def submeter(self, exportacao: ExportacaoInput, usuario: str) -> JobExportacao:
+        if exportacao.tipo not in COLUNAS_EXPORTACAO:
+            raise ValueError("Tipo de exportação inválido.")
+        if exportacao.formato not in ("csv", "json"):
+            raise ValueError("Formato de exportação inválido.")
+        chave = (tuple(exportacao.model_dump().items()), gerenciador_vendas.versao)
+        job = self.cache.get(chave)
+        if job and not job.erro:
+            self.cache.move_to_end(chave)
+            return job
+
+        job = JobExportacao(self.proximo_id, exportacao, gerenciador_vendas.versao, usuario)
+        self.proximo_id += 1
+        self.jobs[job.id_job] = job
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=MAX_PROCESSOS_EXPORTACAO)
+            self.executor = ThreadPoolExecutor(max_workers=MAX_PROCESSOS_EXPORTACAO)
+            self.diretorio = tempfile.mkdtemp(prefix="exportacoes_")
+        job.caminho = os.path.join(self.diretorio, f"{job.id_job}_{exportacao.tipo}.{exportacao.formato}")
+        # No loop de eventos só é feita a fotografia (cópia das referências) dos dados
+        fotografia = gerenciador_vendas.fotografia(exportacao.tipo)
+        job.futuro = self.executor.submit(self._executar, job, fotografia)
+        job.futuro.add_done_callback(lambda futuro: self._concluir(job, futuro))
+
+        self.cache[chave] = job
+        while len(self.cache) > LIMITE_CACHE_EXPORTACOES:
+            _, antigo = self.cache.popitem(last=False)
+            antigo.expirado = True
+            # Jobs ainda em execução removem o arquivo ao concluir
+            if antigo.futuro.done():
+                self._remover_arquivo(antigo)
+        return job
+
+    def obter_job(self, id_job: int) -> JobExportacao:
+        job = self.jobs.get(id_job)
+        if not job:
+            raise ValueError("Exportação não encontrada.")
+        return job
+
+gerenciador_exportacoes = GerenciadorExportacoes()
+
+# Interpreta uma linha de contagem em CSV ("codigo,quantidade") ou NDJSON
+def parsear_linha_contagem(linha: str, formato: str):
+    if formato == "ndjson":
+        registro = json.loads(linha)
+        codigo, quantidade = str(registro["codigo"]), int(registro["quantidade"])
+    else:
+        codigo, quantidade = linha.rsplit(",", 1)
+        codigo, quantidade = codigo.strip().strip('"'), int(quantidade)
+    if quantidade < 0:
+        raise ValueError("quantidade contada não pode ser negativa")
+    return codigo, quantidade
+
 # Simulação de banco de dados de usuários
 usuarios_db: Dict[str, UsuarioInDB] = {
     "user1": UsuarioInDB(
@@ -306,8 +1399,8 @@ async def cadastrar_produto(produto: ProdutoInput, current_user: UsuarioInDB = D
             data=datetime.now(timezone.utc),  # Updated
             usuario=current_user.username
         )
-        gerenciador_vendas.movimentacoes.append(movimentacao)
-        return novo_produto
+        gerenciador_vendas.registrar_movimentacao(movimentacao)
+        return novo_produto.para_dict()
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -324,8 +1417,8 @@ async def adicionar_estoque(codigo: str, quantidade: int, current_user: UsuarioI
             data=datetime.now(timezone.utc),  # Updated
             usuario=current_user.username
         )
-        gerenciador_vendas.movimentacoes.append(movimentacao)
-        return produto_atualizado
+        gerenciador_vendas.registrar_movimentacao(movimentacao)
+        return produto_atualizado.para_dict()
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -342,8 +1435,8 @@ async def remover_estoque(codigo: str, quantidade: int, current_user: UsuarioInD
             data=datetime.now(timezone.utc),  # Updated
             usuario=current_user.username
         )
-        gerenciador_vendas.movimentacoes.append(movimentacao)
-        return produto_atualizado
+        gerenciador_vendas.registrar_movimentacao(movimentacao)
+        return produto_atualizado.para_dict()
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -360,8 +1453,8 @@ async def atualizar_estoque(codigo: str, quantidade: int, current_user: UsuarioI
             data=datetime.now(timezone.utc),  # Updated
             usuario=current_user.username
         )
-        gerenciador_vendas.movimentacoes.append(movimentacao)
-        return produto_atualizado
+        gerenciador_vendas.registrar_movimentacao(movimentacao)
+        return produto_atualizado.para_dict()
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -369,17 +1462,49 @@ async def atualizar_estoque(codigo: str, quantidade: int, current_user: UsuarioI
 @app.get("/produtos/alerta")
 async def alerta_estoque_baixo(current_user: UsuarioInDB = Depends(get_current_user)):
     alerta = gerenciador.alerta_estoque_baixo()
-    return alerta
+    return {codigo: produto.para_dict() for codigo, produto in alerta.items()}
+
+# Endpoint para consultar o estoque de um produto em uma data
+@app.get("/produtos/{codigo}/estoque")
+async def estoque_produto_em(codigo: str, em: Optional[datetime] = None, current_user: UsuarioInDB = Depends(get_current_user)):
+    produto = gerenciador.estoque.get(codigo)
+    if not produto:
+        raise HTTPException(status_code=400, detail="Produto não encontrado")
+    if em is None:
+        return {"codigo": codigo, "em": datetime.now(timezone.utc), "quantidade": produto.quantidade}
+    em = normalizar_data(em)
+    return {"codigo": codigo, "em": em, "quantidade": gerenciador_vendas.estoque_em(codigo, em)}
+
+# Endpoints para preços versionados
+@app.put("/produtos/{codigo}/preco")
+async def alterar_preco(codigo: str, preco: PrecoInput, current_user: UsuarioInDB = Depends(get_current_user)):
+    if codigo not in gerenciador.estoque:
+        raise HTTPException(status_code=400, detail="Produto não encontrado")
+    try:
+        versao = tabela_precos.registrar_preco(codigo, preco.preco, preco.vigencia)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"codigo": codigo, "versao": versao, "preco": preco.preco, "vigencia": tabela_precos.vigencias[versao]}
+
+@app.get("/produtos/{codigo}/precos")
+async def historico_precos(codigo: str, current_user: UsuarioInDB = Depends(get_current_user)):
+    try:
+        return tabela_precos.historico(codigo)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/precos/reprecificar")
+async def reprecificar(reprecificacao: ReprecificacaoInput, current_user: UsuarioInDB = Depends(get_current_user)):
+    try:
+        return await run_in_threadpool(tabela_precos.reprecificar, reprecificacao)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # Endpoint para registrar uma venda
 @app.post("/vendas/")
 async def registrar_venda(venda: VendaInput, current_user: UsuarioInDB = Depends(get_current_user)):
     try:
-        # Atualizar preços com base no estoque atual
-        for item in venda.items:
-            produto = gerenciador.estoque.get(item.codigo)
-            if produto:
-                item.preco_unitario = produto.preco
+        # Os preços são obtidos da tabela de preços vigente ao registrar a venda
         nova_venda = gerenciador_vendas.registrar_venda(venda, current_user.username)
         recibo = gerenciador_vendas.gerar_recibo(nova_venda.id_venda)
         return recibo
@@ -388,20 +1513,76 @@ async def registrar_venda(venda: VendaInput, current_user: UsuarioInDB = Depends
 
 # Endpoint para gerar relatório de vendas
 @app.get("/relatorios/vendas/")
-async def relatorio_vendas(current_user: UsuarioInDB = Depends(get_current_user)):
-    vendas = gerenciador_vendas.relatorio_vendas()
-    return vendas
+async def relatorio_vendas(data_inicio: Optional[datetime] = None, data_fim: Optional[datetime] = None, current_user: UsuarioInDB = Depends(get_current_user)):
+    vendas = gerenciador_vendas.relatorio_vendas(data_inicio, data_fim)
+    return StreamingResponse(lista_json(venda_para_dict(venda) for venda in vendas), media_type="application/json")
 
 # Endpoint para gerar relatório de estoque
 @app.get("/relatorios/estoque/")
 async def relatorio_estoque(current_user: UsuarioInDB = Depends(get_current_user)):
-    return gerenciador.estoque
+    return {codigo: produto.para_dict() for codigo, produto in gerenciador.estoque.items()}
+
+# Endpoint para gerar relatório de estoque em uma data
+@app.get("/relatorios/estoque/historico/")
+async def relatorio_estoque_em(em: datetime, current_user: UsuarioInDB = Depends(get_current_user)):
+    return gerenciador_vendas.relatorio_estoque_em(normalizar_data(em))
+
+# Endpoint para ranking de produtos mais e menos vendidos em uma janela deslizante
+@app.get("/relatorios/ranking/")
+async def ranking_produtos(janela: str = "24h", metrica: str = "unidades", n: int = 10, ordem: str = "melhores", current_user: UsuarioInDB = Depends(get_current_user)):
+    try:
+        return ranking_vendas.top(janela, metrica, n, ordem)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Endpoint para a classificação ABC (Pareto) do catálogo
+@app.get("/relatorios/abc/")
+async def curva_abc(janela: str = "30d", metrica: str = "receita", classe: Optional[str] = None, current_user: UsuarioInDB = Depends(get_current_user)):
+    try:
+        resumo = ranking_vendas.curva_abc(janela, metrica)
+        if classe is None:
+            return {"janela": janela, "metrica": metrica, "resumo": resumo}
+        produtos = ranking_vendas.produtos_abc(janela, metrica, classe)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"janela": janela, "metrica": metrica, "resumo": resumo, "produtos": produtos}
 
 # Endpoint para gerar histórico de movimentações
 @app.get("/relatorios/movimentacoes/")
-async def relatorio_movimentacoes(current_user: UsuarioInDB = Depends(get_current_user)):
-    movimentacoes = gerenciador_vendas.relatorio_movimentacoes()
-    return movimentacoes
+async def relatorio_movimentacoes(data_inicio: Optional[datetime] = None, data_fim: Optional[datetime] = None, current_user: UsuarioInDB = Depends(get_current_user)):
+    movimentacoes = gerenciador_vendas.relatorio_movimentacoes(data_inicio, data_fim)
+    return StreamingResponse(lista_json(movimentacoes), media_type="application/json")
+
+# Endpoint para mover para o arquivo o histórico anterior ao corte (padrão: DIAS_HISTORICO_QUENTE)
+@app.post("/relatorios/arquivar/")
+async def arquivar_historico(corte: Optional[datetime] = None, current_user: UsuarioInDB = Depends(get_current_user)):
+    return await run_in_threadpool(gerenciador_vendas.arquivar, corte)
+
+# Endpoints para exportações de relatórios em segundo plano
+@app.post("/relatorios/exportacoes/")
+async def submeter_exportacao(exportacao: ExportacaoInput, current_user: UsuarioInDB = Depends(get_current_user)):
+    try:
+        return gerenciador_exportacoes.submeter(exportacao, current_user.username).resumo()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/relatorios/exportacoes/{id_job}")
+async def status_exportacao(id_job: int, current_user: UsuarioInDB = Depends(get_current_user)):
+    try:
+        return gerenciador_exportacoes.obter_job(id_job).resumo()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/relatorios/exportacoes/{id_job}/arquivo")
+async def baixar_exportacao(id_job: int, current_user: UsuarioInDB = Depends(get_current_user)):
+    try:
+        job = gerenciador_exportacoes.obter_job(id_job)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if job.status != "concluido":
+        raise HTTPException(status_code=400, detail=f"Exportação não disponível (status: {job.status}).")
+    media_type = "application/json" if job.exportacao.formato == "json" else "text/csv"
+    return FileResponse(job.caminho, media_type=media_type, filename=os.path.basename(job.caminho))
 
 # Endpoints para gerenciar promoções
 @app.post("/promocoes/")
@@ -415,6 +1596,332 @@ async def criar_promocao(promocao: Promocao, current_user: UsuarioInDB = Depends
 async def listar_promocoes(current_user: UsuarioInDB = Depends(get_current_user)):
     return list(promocoes_db.values())
 
+# Endpoints para inventário físico (contagem de estoque)
+@app.post("/inventarios/")
+async def abrir_inventario(current_user: UsuarioInDB = Depends(get_current_user)):
+    sessao = gerenciador_inventario.abrir_sessao(current_user.username)
+    return sessao.resumo()
+
+@app.get("/inventarios/{id_sessao}")
+async def obter_inventario(id_sessao: int, current_user: UsuarioInDB = Depends(get_current_user)):
+    try:
+        return gerenciador_inventario.obter_sessao(id_sessao).resumo()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Recebe as contagens em CSV (codigo,quantidade) ou NDJSON, lidas do corpo em streaming
+@app.post("/inventarios/{id_sessao}/contagens")
+async def enviar_contagens(id_sessao: int, request: Request, current_user: UsuarioInDB = Depends(get_current_user)):
+    try:
+        gerenciador_inventario.obter_sessao(id_sessao)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    content_type = request.headers.get("content-type", "")
+    formato = "ndjson" if "json" in content_type else "csv"
+    contagens: Dict[str, int] = {}
+    linhas = 0
+    numero_linha = 0
+    resto = ""
+    # Decodificador incremental: um caractere multibyte pode chegar dividido entre blocos
+    decodificador = codecs.getincrementaldecoder("utf-8")()
+
+    def processar(linha: str):
+        nonlocal linhas
+        linha = linha.strip()
+        if not linha:
+            return
+        if formato == "csv" and numero_linha == 1 and linha.lower().replace('"', "").replace(" ", "") == "codigo,quantidade":
+            return
+        codigo, quantidade = parsear_linha_contagem(linha, formato)
+        contagens[codigo] = contagens.get(codigo, 0) + quantidade
+        linhas += 1
+
+    try:
+        async for bloco in request.stream():
+            partes = (resto + decodificador.decode(bloco)).split("\n")
+            resto = partes.pop()
+            for linha in partes:
+                numero_linha += 1
+                processar(linha)
+        resto += decodificador.decode(b"", final=True)
+        if resto:
+            numero_linha += 1
+            processar(resto)
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Linha {numero_linha} inválida: {e}")
+    try:
+        sessao = gerenciador_inventario.registrar_contagens(id_sessao, contagens, linhas)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    resumo = sessao.resumo()
+    resumo["linhas_lote"] = linhas
+    return resumo
+
+@app.post("/inventarios/{id_sessao}/fechar")
+async def fechar_inventario(id_sessao: int, current_user: UsuarioInDB = Depends(get_current_user)):
+    try:
+        return gerenciador_inventario.fechar_sessao(id_sessao, current_user.username)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Estado em memória da aplicação, usado para gravar e reproduzir tráfego. A fotografia
+# contém só dados (JSON); estruturas derivadas, como o ranking, são reconstruídas.
+def _codificar_json(valor):
+    if isinstance(valor, datetime):
+        return {"__data__": valor.isoformat()}
+    if isinstance(valor, set):
+        return sorted(valor)
+    raise TypeError(f"Tipo não serializável: {type(valor).__name__}")
+
+def _decodificar_json(objeto: Dict):
+    if len(objeto) == 1 and "__data__" in objeto:
+        return datetime.fromisoformat(objeto["__data__"])
+    return objeto
+
+# As partes do arquivo histórico vão dentro da fotografia, para que a reprodução
+# não dependa do diretório (nem altere os arquivos) do servidor gravado
+def embutir_partes(partes: Dict[str, List[Dict]]) -> Dict[str, List[Dict]]:
+    embutidas = {}
+    for tabela, lista in partes.items():
+        embutidas[tabela] = []
+        for parte in lista:
+            with open(parte["caminho"], "rb") as arquivo:
+                conteudo = base64.b64encode(arquivo.read()).decode("ascii")
+            embutidas[tabela].append({
+                "mes": os.path.basename(os.path.dirname(parte["caminho"])),
+                "nome": os.path.basename(parte["caminho"]),
+                "linhas": parte["linhas"],
+                "colunas": parte["colunas"],
+                "conteudo": conteudo,
+            })
+    return embutidas
+
+def extrair_partes(embutidas: Dict[str, List[Dict]], diretorio: str) -> Dict[str, List[Dict]]:
+    partes = {}
+    for tabela, lista in embutidas.items():
+        partes[tabela] = []
+        for parte in lista:
+            pasta = os.path.join(diretorio, tabela, parte["mes"])
+            os.makedirs(pasta, exist_ok=True)
+            caminho = os.path.join(pasta, parte["nome"])
+            with open(caminho, "wb") as arquivo:
+                arquivo.write(base64.b64decode(parte["conteudo"]))
+            partes[tabela].append({"caminho": caminho, "linhas": parte["linhas"], "colunas": parte["colunas"]})
+    return partes
+
+def exportar_estado() -> bytes:
+    # Histórico em memória e partes arquivadas lidos juntos, sem um arquivamento no meio
+    with gerenciador_vendas.lock:
+        vendas = [
+            {**vars(venda), "itens": [item.model_dump() for item in venda.itens]}
+            for venda in gerenciador_vendas.vendas
+        ]
+        movimentacoes = [movimentacao.model_dump() for movimentacao in gerenciador_vendas.movimentacoes]
+        movimentacoes_arquivadas = gerenciador_vendas.movimentacoes_arquivadas
+        partes = dict(arquivo_historico.partes)
+    estado = {
+        "produtos": [vars(produto) for produto in gerenciador.estoque.values()],
+        "precos": {
+            "precos": list(tabela_precos.precos),
+            "vigencias": tabela_precos.vigencias,
+            "historicos": tabela_precos.historicos,
+        },
+        "vendas": {
+            "vendas": vendas,
+            "movimentacoes": movimentacoes,
+            "proximo_id": gerenciador_vendas.proximo_id,
+            "versao": gerenciador_vendas.versao,
+            "saldos": gerenciador_vendas.saldos,
+            "movimentacoes_arquivadas": movimentacoes_arquivadas,
+            "checkpoints": [[checkpoint.indice, checkpoint.data] for checkpoint in gerenciador_vendas.checkpoints],
+            "saldos_checkpoint": gerenciador_vendas.saldos_checkpoint,
+            "alterados_desde_checkpoint": gerenciador_vendas.alterados_desde_checkpoint,
+        },
+        "arquivo": embutir_partes(partes),
+        "inventario": {
+            "proximo_id": gerenciador_inventario.proximo_id,
+            "sessoes": [vars(sessao) for sessao in gerenciador_inventario.sessoes.values()],
+        },
+        # Hashes de senha não saem da aplicação; ver restaurar_estado
+        "usuarios": [
+            {**usuario.model_dump(), "hashed_password": GravadorTrafego.REDIGIDO}
+            for usuario in usuarios_db.values()
+        ],
+        "promocoes": [promocao.model_dump() for promocao in promocoes_db.values()],
+    }
+    return zlib.compress(json.dumps(estado, default=_codificar_json).encode("utf-8"))
+
+def restaurar_estado(dados: bytes):
+    estado = json.loads(zlib.decompress(dados), object_hook=_decodificar_json)
+    # Os objetos globais são atualizados no lugar para manter as referências existentes
+    gerenciador.estoque.clear()
+    for produto in estado["produtos"]:
+        gerenciador.estoque[produto["codigo"]] = Produto(**produto)
+
+    precos = estado["precos"]
+    tabela_precos.precos = array("d", precos["precos"])
+    tabela_precos.vigencias = precos["vigencias"]
+    tabela_precos.historicos = {
+        codigo: (datas, versoes) for codigo, (datas, versoes) in precos["historicos"].items()
+    }
+
+    vendas = estado["vendas"]
+    gerenciador_vendas.__init__()
+    gerenciador_vendas.vendas = [
+        VendaInternal(**{**venda, "itens": [SaleItem(**item) for item in venda["itens"]]})
+        for venda in vendas["vendas"]
+    ]
+    gerenciador_vendas.movimentacoes = [Movimentacao(**movimentacao) for movimentacao in vendas["movimentacoes"]]
+    gerenciador_vendas.proximo_id = vendas["proximo_id"]
+    gerenciador_vendas.versao = vendas["versao"]
+    gerenciador_vendas.saldos = vendas["saldos"]
+    gerenciador_vendas.movimentacoes_arquivadas = vendas["movimentacoes_arquivadas"]
+    gerenciador_vendas.checkpoints = [CheckpointEstoque(indice, data) for indice, data in vendas["checkpoints"]]
+    gerenciador_vendas.datas_checkpoints = [checkpoint.data for checkpoint in gerenciador_vendas.checkpoints]
+    gerenciador_vendas.saldos_checkpoint = {
+        codigo: (indices, saldos) for codigo, (indices, saldos) in vendas["saldos_checkpoint"].items()
+    }
+    gerenciador_vendas.alterados_desde_checkpoint = set(vendas["alterados_desde_checkpoint"])
+
+    # O arquivo restaurado fica num diretório próprio, removido ao fim do processo
+    diretorio = tempfile.mkdtemp(prefix="arquivo_reproducao_")
+    atexit.register(shutil.rmtree, diretorio, True)
+    arquivo_historico.diretorio = diretorio
+    arquivo_historico.partes = extrair_partes(estado["arquivo"], diretorio)
+
+    gerenciador_inventario.__init__()
+    gerenciador_inventario.proximo_id = estado["inventario"]["proximo_id"]
+    for dados_sessao in estado["inventario"]["sessoes"]:
+        sessao = SessaoInventario(dados_sessao["id_sessao"], dados_sessao["data_abertura"], dados_sessao["usuario"])
+        sessao.__dict__.update(dados_sessao)
+        gerenciador_inventario.sessoes[sessao.id_sessao] = sessao
+
+    # O ranking cobre no máximo 30 dias, sempre dentro do histórico em memória
+    ranking_vendas.__init__()
+    for codigo in gerenciador.estoque:
+        ranking_vendas.incluir_produto(codigo)
+    for venda in gerenciador_vendas.vendas:
+        ranking_vendas.registrar_venda(venda)
+
+    # Os hashes não foram gravados: todos os usuários passam a ter a senha redigida,
+    # a mesma que os logins gravados (POST /token) enviam na reprodução
+    senha_redigida = hash_password(GravadorTrafego.REDIGIDO)
+    usuarios_db.clear()
+    usuarios_db.update({
+        usuario["username"]: UsuarioInDB(**{**usuario, "hashed_password": senha_redigida})
+        for usuario in estado["usuarios"]
+    })
+    promocoes_db.clear()
+    promocoes_db.update({promocao["codigo"]: Promocao(**promocao) for promocao in estado["promocoes"]})
+    gerenciador_exportacoes.cache.clear()
+
+# Middleware opcional que grava as requisições (rota, corpo, usuário e tempos) em um
+# arquivo NDJSON compactado; a primeira linha guarda o estado inicial da aplicação
+class GravadorTrafego:
+    # O token de acesso não é gravado; só o usuário autenticado por ele
+    HEADERS_GRAVADOS = (b"content-type",)
+    CAMPOS_SENSIVEIS = {"password", "hashed_password", "client_secret"}
+    REDIGIDO = "***"
+
+    def __init__(self, app, caminho: str):
+        self.app = app
+        self.caminho = caminho
+        self.arquivo = None
+        self.inicio = None
+        self.lock = threading.Lock()
+
+    def _abrir(self):
+        self.inicio = time.perf_counter()
+        self.arquivo = gzip.open(self.caminho, "wt", encoding="utf-8")
+        cabecalho = {
+            "versao": 2,
+            "inicio": datetime.now(timezone.utc).isoformat(),
+            "estado": base64.b64encode(exportar_estado()).decode("ascii"),
+        }
+        self.arquivo.write(json.dumps(cabecalho) + "\n")
+        atexit.register(self.fechar)
+
+    # Remove senhas do corpo (JSON ou formulário) antes de gravá-lo
+    def _redigir_corpo(self, corpo: bytes, content_type: str) -> tuple:
+        try:
+            if "application/json" in content_type:
+                dados = json.loads(corpo)
+                if isinstance(dados, dict) and self.CAMPOS_SENSIVEIS & dados.keys():
+                    for campo in self.CAMPOS_SENSIVEIS & dados.keys():
+                        dados[campo] = self.REDIGIDO
+                    return json.dumps(dados).encode("utf-8"), True
+            elif "application/x-www-form-urlencoded" in content_type:
+                campos = parse_qsl(corpo.decode("utf-8"), keep_blank_values=True)
+                if any(nome in self.CAMPOS_SENSIVEIS for nome, _ in campos):
+                    campos = [(nome, self.REDIGIDO if nome in self.CAMPOS_SENSIVEIS else valor) for nome, valor in campos]
+                    return urlencode(campos).encode("utf-8"), True
+        except (ValueError, UnicodeDecodeError):
+            pass
+        return corpo, False
+
+    def fechar(self):
+        with self.lock:
+            if self.arquivo:
+                self.arquivo.close()
+                self.arquivo = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with self.lock:
+            if self.arquivo is None:
+                self._abrir()
+        inicio = time.perf_counter()
+        corpo = []
+        resposta = {"status": None}
+
+        async def receive_gravado():
+            mensagem = await receive()
+            if mensagem["type"] == "http.request":
+                corpo.append(mensagem.get("body", b""))
+            return mensagem
+
+        async def send_gravado(mensagem):
+            if mensagem["type"] == "http.response.start":
+                resposta["status"] = mensagem["status"]
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive_gravado, send_gravado)
+        finally:
+            fim = time.perf_counter()
+            headers = {
+                nome.decode("latin-1"): valor.decode("latin-1")
+                for nome, valor in scope["headers"] if nome in self.HEADERS_GRAVADOS
+            }
+            autorizacao = next(
+                (valor.decode("latin-1") for nome, valor in scope["headers"] if nome == b"authorization"), ""
+            )
+            usuario = usuarios_db.get(autorizacao[7:]) if autorizacao.startswith("Bearer ") else None
+            corpo_gravado, redigido = self._redigir_corpo(b"".join(corpo), headers.get("content-type", ""))
+            rota = scope.get("route")
+            registro = {
+                "t": round(inicio - self.inicio, 6),
+                "metodo": scope["method"],
+                "caminho": scope["path"],
+                "rota": rota.path if rota is not None else None,
+                "query": scope["query_string"].decode("latin-1"),
+                "headers": headers,
+                "usuario": usuario.username if usuario else None,
+                "corpo": base64.b64encode(corpo_gravado).decode("ascii"),
+                "redigido": redigido,
+                "status": resposta["status"],
+                "duracao": round(fim - inicio, 6),
+            }
+            with self.lock:
+                if self.arquivo:
+                    self.arquivo.write(json.dumps(registro) + "\n")
+
+# Gravação de tráfego habilitada pela variável de ambiente GRAVAR_TRAFEGO (caminho do arquivo)
+if os.environ.get("GRAVAR_TRAFEGO"):
+    app.add_middleware(GravadorTrafego, caminho=os.environ["GRAVAR_TRAFEGO"])
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,158 @@
+# replay.py
+# Reproduz um arquivo de tráfego gravado pelo middleware GravadorTrafego (app.py)
+# contra a aplicação em processo, a partir do estado inicial gravado.
+#
+# Uso: python replay.py trafego.ndjson.gz [--velocidade 2.0] [--concorrencia 100]
+#   --velocidade 1 reproduz no ritmo original, 2 no dobro da velocidade e
+#   0 o mais rápido possível. As requisições são disparadas concorrentemente
+#   nos instantes gravados, limitadas por --concorrencia.
+
+import argparse
+import asyncio
+import base64
+import gzip
+import json
+import time
+from typing import Dict, List
+
+import httpx
+
+import app as aplicacao
+
+def carregar_gravacao(caminho: str):
+    with gzip.open(caminho, "rt", encoding="utf-8") as arquivo:
+        cabecalho = json.loads(arquivo.readline())
+        registros = [json.loads(linha) for linha in arquivo if linha.strip()]
+    return cabecalho, registros
+
+def percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+def resumo_latencias(valores: List[float]) -> Dict:
+    return {
+        "p50": percentil(valores, 50),
+        "p95": percentil(valores, 95),
+        "p99": percentil(valores, 99),
+    }
+
+def montar_headers(registro: Dict) -> Dict[str, str]:
+    headers = dict(registro["headers"])
+    # O token não é gravado; nesta aplicação o token de acesso é o próprio nome do usuário
+    if registro.get("usuario"):
+        headers["authorization"] = f"Bearer {registro['usuario']}"
+    return headers
+
+async def _reproduzir_registros(registros: List[Dict], velocidade: float, concorrencia: int):
+    transporte = httpx.ASGITransport(app=aplicacao.app)
+    limite = asyncio.Semaphore(concorrencia)
+    resultados = [None] * len(registros)
+
+    async with httpx.AsyncClient(transport=transporte, base_url="http://testserver") as client:
+        inicio = time.perf_counter()
+
+        # Cada requisição parte no seu deslocamento "t" original, sem esperar as anteriores
+        async def enviar(indice: int, registro: Dict):
+            if velocidade > 0:
+                espera = inicio + registro["t"] / velocidade - time.perf_counter()
+                if espera > 0:
+                    await asyncio.sleep(espera)
+            url = registro["caminho"]
+            if registro["query"]:
+                url += "?" + registro["query"]
+            async with limite:
+                antes = time.perf_counter()
+                try:
+                    response = await client.request(
+                        registro["metodo"],
+                        url,
+                        content=base64.b64decode(registro["corpo"]),
+                        headers=montar_headers(registro),
+                    )
+                    status, erro = response.status_code, None
+                except Exception as e:
+                    # Uma exceção da aplicação conta como erro 500 desta requisição,
+                    # sem interromper as demais
+                    status, erro = 500, f"{type(e).__name__}: {e}"
+                resultados[indice] = (status, time.perf_counter() - antes, erro)
+
+        await asyncio.gather(*(enviar(indice, registro) for indice, registro in enumerate(registros)))
+        return resultados, time.perf_counter() - inicio
+
+def reproduzir(caminho: str, velocidade: float = 1.0, concorrencia: int = 100) -> Dict:
+    cabecalho, registros = carregar_gravacao(caminho)
+    aplicacao.restaurar_estado(base64.b64decode(cabecalho["estado"]))
+    resultados, tempo_reproducao = asyncio.run(_reproduzir_registros(registros, velocidade, concorrencia))
+
+    por_rota: Dict[str, Dict[str, List[float]]] = {}
+    divergencias = 0
+    redigidas = 0
+    erros = []
+    for registro, (status, duracao, erro) in zip(registros, resultados):
+        if erro:
+            erros.append({"metodo": registro["metodo"], "caminho": registro["caminho"], "erro": erro})
+        # Requisições redigidas enviam a senha "***", aceita para todos os usuários
+        # restaurados, então um login recusado na gravação passa a ser aceito
+        if registro.get("redigido"):
+            redigidas += 1
+        elif status != registro["status"]:
+            divergencias += 1
+        rota = por_rota.setdefault(
+            f"{registro['metodo']} {registro['rota'] or registro['caminho']}",
+            {"gravado": [], "reproduzido": []},
+        )
+        rota["gravado"].append(registro["duracao"])
+        rota["reproduzido"].append(duracao)
+
+    tempo_gravado = max((r["t"] + r["duracao"] for r in registros), default=0.0)
+    total = len(registros)
+    return {
+        "requisicoes": total,
+        "divergencias_status": divergencias,
+        "redigidas": redigidas,
+        "erros": erros,
+        "vazao_gravada": total / tempo_gravado if tempo_gravado else 0.0,
+        "vazao_reproduzida": total / tempo_reproducao if tempo_reproducao else 0.0,
+        "rotas": {
+            rota: {
+                "requisicoes": len(latencias["gravado"]),
+                "gravado": resumo_latencias(latencias["gravado"]),
+                "reproduzido": resumo_latencias(latencias["reproduzido"]),
+            }
+            for rota, latencias in por_rota.items()
+        },
+    }
+
+def imprimir_relatorio(relatorio: Dict):
+    print(
+        f"Requisições: {relatorio['requisicoes']} (status divergentes: {relatorio['divergencias_status']}, "
+        f"redigidas: {relatorio['redigidas']}, erros: {len(relatorio['erros'])})"
+    )
+    for erro in relatorio["erros"]:
+        print(f"  erro em {erro['metodo']} {erro['caminho']}: {erro['erro']}")
+    print(f"Vazão gravada: {relatorio['vazao_gravada']:.1f} req/s | reproduzida: {relatorio['vazao_reproduzida']:.1f} req/s")
+    print(f"{'rota':<50} {'n':>6} {'p50 grav':>10} {'p50 repr':>10} {'p99 grav':>10} {'p99 repr':>10} {'dif p50':>8}")
+    for rota, dados in sorted(relatorio["rotas"].items()):
+        gravado, reproduzido = dados["gravado"], dados["reproduzido"]
+        diferenca = (reproduzido["p50"] / gravado["p50"] - 1) * 100 if gravado["p50"] else 0.0
+        print(
+            f"{rota:<50} {dados['requisicoes']:>6} "
+            f"{gravado['p50'] * 1000:>8.2f}ms {reproduzido['p50'] * 1000:>8.2f}ms "
+            f"{gravado['p99'] * 1000:>8.2f}ms {reproduzido['p99'] * 1000:>8.2f}ms {diferenca:>+7.1f}%"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproduz tráfego gravado contra a aplicação.")
+    parser.add_argument("arquivo", help="Arquivo gravado com GRAVAR_TRAFEGO")
+    parser.add_argument("--velocidade", type=float, default=1.0, help="Fator de velocidade (0 = sem espera)")
+    parser.add_argument("--concorrencia", type=int, default=100, help="Máximo de requisições simultâneas")
+    parser.add_argument("--json", action="store_true", help="Imprime o relatório em JSON")
+    args = parser.parse_args()
+    relatorio = reproduzir(args.arquivo, args.velocidade, args.concorrencia)
+    if args.json:
+        print(json.dumps(relatorio, indent=2))
+    else:
+        imprimir_relatorio(relatorio)
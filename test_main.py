@@ -387,3 +387,575 @@ def test_create_promotion_invalid_data(auth_token):
         # If no validation, ensure the promotion is created
         data = response.json()
         assert data["desconto_percentual"] == 150.0
+
+def test_stocktake_session(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    for codigo, quantidade in [("INV001", 10), ("INV002", 8)]:
+        product_data = {
+            "nome": f"Inventory {codigo}",
+            "codigo": codigo,
+            "categoria": "Inventory",
+            "quantidade": quantidade,
+            "preco": 5.0,
+            "descricao": "Product used for stocktake tests.",
+            "fornecedor": "Test Supplier",
+        }
+        response = client.post("/produtos/", json=product_data, headers=headers)
+        assert response.status_code == 200, f"Product creation failed: {response.text}"
+
+    response = client.post("/inventarios/", headers=headers)
+    assert response.status_code == 200, f"Open stocktake failed: {response.text}"
+    id_sessao = response.json()["id_sessao"]
+
+    # Two scanners counting the same session, one in CSV and one in NDJSON
+    response = client.post(
+        f"/inventarios/{id_sessao}/contagens",
+        content="codigo,quantidade\nINV001,7\nINV002,3\n",
+        headers={**headers, "Content-Type": "text/csv"},
+    )
+    assert response.status_code == 200, f"CSV count failed: {response.text}"
+    assert response.json()["linhas_lote"] == 2
+    response = client.post(
+        f"/inventarios/{id_sessao}/contagens",
+        content='{"codigo": "INV002", "quantidade": 6}\n',
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200, f"NDJSON count failed: {response.text}"
+
+    # A batch with an unknown product is rejected as a whole
+    response = client.post(
+        f"/inventarios/{id_sessao}/contagens",
+        content="INV001,1\nUNKNOWN,1\n",
+        headers={**headers, "Content-Type": "text/csv"},
+    )
+    assert response.status_code == 400, "Count with unknown product should fail"
+
+    response = client.post(f"/inventarios/{id_sessao}/fechar", headers=headers)
+    assert response.status_code == 200, f"Close stocktake failed: {response.text}"
+    data = response.json()
+    assert data["produtos_ajustados"] == 2
+    assert data["ajuste_positivo"] == 1
+    assert data["ajuste_negativo"] == -3
+
+    estoque = client.get("/relatorios/estoque/", headers=headers).json()
+    assert estoque["INV001"]["quantidade"] == 7
+    assert estoque["INV002"]["quantidade"] == 9
+    movimentacoes = client.get("/relatorios/movimentacoes/", headers=headers).json()
+    ajustes = {m["codigo_produto"]: m["quantidade"] for m in movimentacoes if m["tipo"] == "ajuste"}
+    assert ajustes == {"INV001": -3, "INV002": 1}
+
+    response = client.post(f"/inventarios/{id_sessao}/fechar", headers=headers)
+    assert response.status_code == 400, "Closing a stocktake twice should fail"
+
+def test_stock_as_of(auth_token, monkeypatch):
+    import app as app_module
+    monkeypatch.setattr(app_module, "INTERVALO_CHECKPOINT", 2)
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    product_data = {
+        "nome": "History Product",
+        "codigo": "HIS001",
+        "categoria": "History",
+        "quantidade": 10,
+        "preco": 3.0,
+        "descricao": "Product used for point-in-time tests.",
+        "fornecedor": "Test Supplier",
+    }
+    antes = datetime.now(timezone.utc)
+    response = client.post("/produtos/", json=product_data, headers=headers)
+    assert response.status_code == 200, f"Product creation failed: {response.text}"
+    depois_cadastro = datetime.now(timezone.utc)
+    client.put("/produtos/HIS001/adicionar", params={"quantidade": 5}, headers=headers)
+    depois_adicao = datetime.now(timezone.utc)
+    client.put("/produtos/HIS001/atualizar", params={"quantidade": 2}, headers=headers)
+    client.put("/produtos/HIS001/adicionar", params={"quantidade": 1}, headers=headers)
+
+    esperado = [(antes, 0), (depois_cadastro, 10), (depois_adicao, 15), (datetime.now(timezone.utc), 3)]
+    for em, quantidade in esperado:
+        response = client.get(
+            "/produtos/HIS001/estoque",
+            params={"em": em.isoformat()},
+            headers=headers,
+        )
+        assert response.status_code == 200, f"Point-in-time query failed: {response.text}"
+        assert response.json()["quantidade"] == quantidade
+
+    response = client.get(
+        "/relatorios/estoque/historico/",
+        params={"em": depois_adicao.isoformat()},
+        headers=headers,
+    )
+    assert response.status_code == 200, f"As-of report failed: {response.text}"
+    assert response.json()["HIS001"] == 15
+
+def test_background_export(auth_token, create_product):
+    import time
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    codigo = create_product["codigo"]
+    export_data = {"tipo": "movimentacoes", "formato": "csv", "codigo_produto": codigo}
+    response = client.post("/relatorios/exportacoes/", json=export_data, headers=headers)
+    assert response.status_code == 200, f"Export submission failed: {response.text}"
+    job = response.json()
+
+    # Identical submission against the same data version reuses the job
+    response = client.post("/relatorios/exportacoes/", json=export_data, headers=headers)
+    assert response.json()["id_job"] == job["id_job"]
+
+    for _ in range(300):
+        job = client.get(f"/relatorios/exportacoes/{job['id_job']}", headers=headers).json()
+        if job["status"] not in ("pendente", "executando"):
+            break
+        time.sleep(0.1)
+    assert job["status"] == "concluido", f"Export did not finish: {job}"
+
+    response = client.get(f"/relatorios/exportacoes/{job['id_job']}/arquivo", headers=headers)
+    assert response.status_code == 200, f"Export download failed: {response.text}"
+    linhas = response.text.strip().splitlines()
+    assert linhas[0] == "tipo,codigo_produto,quantidade,data,usuario"
+    assert len(linhas) > 1
+    assert all(f",{codigo}," in linha for linha in linhas[1:])
+
+    response = client.post(
+        "/relatorios/exportacoes/",
+        json={"tipo": "invalido"},
+        headers=headers,
+    )
+    assert response.status_code == 400, "Invalid export type should fail"
+
+def test_versioned_prices_and_bulk_repricing(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    for codigo, fornecedor in [("PRC001", "Supplier A"), ("PRC002", "Supplier A"), ("PRC003", "Supplier B")]:
+        product_data = {
+            "nome": f"Priced {codigo}",
+            "codigo": codigo,
+            "categoria": "Pricing",
+            "quantidade": 100,
+            "preco": 10.0,
+            "descricao": "Product used for pricing tests.",
+            "fornecedor": fornecedor,
+        }
+        response = client.post("/produtos/", json=product_data, headers=headers)
+        assert response.status_code == 200, f"Product creation failed: {response.text}"
+
+    response = client.put("/produtos/PRC001/preco", json={"preco": 12.0}, headers=headers)
+    assert response.status_code == 200, f"Price change failed: {response.text}"
+
+    # A future price does not affect sales made now
+    response = client.put(
+        "/produtos/PRC001/preco",
+        json={"preco": 99.0, "vigencia": "2999-01-01T00:00:00Z"},
+        headers=headers,
+    )
+    assert response.status_code == 200, f"Future price change failed: {response.text}"
+
+    response = client.post(
+        "/precos/reprecificar",
+        json={"fornecedor": "Supplier A", "modo": "percentual", "valor": 10.0},
+        headers=headers,
+    )
+    assert response.status_code == 200, f"Bulk repricing failed: {response.text}"
+    assert response.json()["produtos_reprecificados"] == 2
+
+    response = client.post(
+        "/precos/reprecificar",
+        json={"codigos": ["PRC003"], "modo": "absoluto", "valor": -20.0},
+        headers=headers,
+    )
+    assert response.status_code == 400, "Repricing to a negative price should fail"
+
+    historico = client.get("/produtos/PRC001/precos", headers=headers).json()
+    assert [versao["preco"] for versao in historico] == [10.0, 12.0, 13.2, 99.0]
+
+    sale_data = {
+        "items": [
+            {"codigo": "PRC001", "quantidade": 1, "preco_unitario": 1.0},
+            {"codigo": "PRC003", "quantidade": 2, "preco_unitario": 1.0},
+        ],
+        "desconto_total": 0.0,
+    }
+    response = client.post("/vendas/", json=sale_data, headers=headers)
+    assert response.status_code == 200, f"Register sale failed: {response.text}"
+    data = response.json()
+    assert data["total"] == round(13.2 + 2 * 10.0, 2)
+    assert data["itens"][0]["versao_preco"] == historico[2]["versao"]
+    vendas = client.get("/relatorios/vendas/", headers=headers).json()
+    venda = next(v for v in vendas if v["id_venda"] == data["id_venda"])
+    assert venda["itens"][0]["preco_unitario"] == 13.2
+
+def test_traffic_capture_and_replay(setup_user, auth_token, monkeypatch, tmp_path):
+    import shutil
+    from app import GravadorTrafego, arquivo_historico, verify_password
+    from replay import reproduzir
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    # Archive the history so the recorded state references part files
+    servidor = tmp_path / "servidor"
+    monkeypatch.setattr(arquivo_historico, "diretorio", str(servidor))
+    monkeypatch.setattr(arquivo_historico, "partes", {"vendas": [], "movimentacoes": []})
+    archived_product = {
+        "nome": "Archived Replay Product",
+        "codigo": "RPL000",
+        "categoria": "Replay",
+        "quantidade": 3,
+        "preco": 1.0,
+        "descricao": "Product whose movement is archived before recording.",
+        "fornecedor": "Test Supplier",
+    }
+    assert client.post("/produtos/", json=archived_product, headers=headers).status_code == 200
+    corte = datetime.now(timezone.utc).isoformat()
+    assert client.post("/relatorios/arquivar/", params={"corte": corte}, headers=headers).status_code == 200
+    assert arquivo_historico.partes["movimentacoes"]
+    usuarios = dict(usuarios_db)
+
+    caminho = str(tmp_path / "trafego.ndjson.gz")
+    gravador = GravadorTrafego(app, caminho)
+    gravando = TestClient(gravador)
+    product_data = {
+        "nome": "Replay Product",
+        "codigo": "RPL001",
+        "categoria": "Replay",
+        "quantidade": 10,
+        "preco": 2.0,
+        "descricao": "Product used for replay tests.",
+        "fornecedor": "Test Supplier",
+    }
+    assert gravando.post("/produtos/", json=product_data, headers=headers).status_code == 200
+    assert gravando.put("/produtos/RPL001/adicionar", params={"quantidade": 5}, headers=headers).status_code == 200
+    assert gravando.get("/produtos/alerta", headers=headers).status_code == 200
+    user_data = {"username": "replayuser", "password": "segredo-replay", "full_name": "Replay User"}
+    assert gravando.post("/usuarios/", json=user_data).status_code == 200
+    response = gravando.post("/token", data={"username": "replayuser", "password": "segredo-replay"})
+    token = response.json()["access_token"]
+    assert gravando.get("/produtos/alerta", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+    response = gravando.post("/token", data={"username": setup_user["username"], "password": setup_user["password"]})
+    assert response.status_code == 200
+    assert gravando.get("/relatorios/movimentacoes/", headers=headers).status_code == 200
+    gravador.fechar()
+
+    # Passwords, password hashes and tokens never reach the capture file
+    import base64, gzip, json
+    with gzip.open(caminho, "rt", encoding="utf-8") as arquivo:
+        linhas = arquivo.read().splitlines()
+    conteudo = "\n".join(linhas) + "".join(
+        base64.b64decode(json.loads(linha)["corpo"]).decode() for linha in linhas[1:]
+    )
+    assert "segredo-replay" not in conteudo
+    assert setup_user["password"] not in conteudo
+    assert "authorization" not in conteudo.lower()
+    assert usuarios_db["replayuser"].hashed_password not in conteudo
+    registros = [json.loads(linha) for linha in linhas[1:]]
+    assert registros[5]["usuario"] == "replayuser"
+    assert [registro["redigido"] for registro in registros] == [False, False, False, True, True, False, True, False]
+
+    # The capture carries the archived parts: replay works without the server's directory
+    # and writes its own parts elsewhere
+    shutil.rmtree(servidor)
+    # The recorded state predates the product, so replaying recreates it without conflicts
+    relatorio = reproduzir(caminho, velocidade=1)
+    # Redacted logins authenticate with the redacted password
+    assert verify_password(GravadorTrafego.REDIGIDO, usuarios_db[setup_user["username"]].hashed_password)
+    usuarios_db.update(usuarios)
+    assert relatorio["erros"] == []
+    assert relatorio["requisicoes"] == 8
+    assert relatorio["redigidas"] == 3
+    assert relatorio["divergencias_status"] == 0
+    assert not servidor.exists()
+    assert not arquivo_historico.diretorio.startswith(str(tmp_path))
+    assert "PUT /produtos/{codigo}/adicionar" in relatorio["rotas"]
+    estoque = client.get("/relatorios/estoque/", headers=headers).json()
+    assert estoque["RPL001"]["quantidade"] == 15
+
+def test_best_sellers_and_abc(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    for codigo, preco in [("RNK001", 1.0), ("RNK002", 1000.0), ("RNK003", 1.0)]:
+        product_data = {
+            "nome": f"Ranked {codigo}",
+            "codigo": codigo,
+            "categoria": "Ranking",
+            "quantidade": 1000,
+            "preco": preco,
+            "descricao": "Product used for ranking tests.",
+            "fornecedor": "Test Supplier",
+        }
+        response = client.post("/produtos/", json=product_data, headers=headers)
+        assert response.status_code == 200, f"Product creation failed: {response.text}"
+    sale_data = {
+        "items": [
+            {"codigo": "RNK001", "quantidade": 500, "preco_unitario": 1.0},
+            {"codigo": "RNK002", "quantidade": 1, "preco_unitario": 1000.0},
+        ],
+        "desconto_total": 0.0,
+    }
+    response = client.post("/vendas/", json=sale_data, headers=headers)
+    assert response.status_code == 200, f"Register sale failed: {response.text}"
+
+    response = client.get("/relatorios/ranking/", params={"janela": "1h", "metrica": "unidades", "n": 1}, headers=headers)
+    assert response.status_code == 200, f"Ranking failed: {response.text}"
+    assert response.json() == [{"codigo": "RNK001", "unidades": 500, "receita": 500.0}]
+
+    response = client.get("/relatorios/ranking/", params={"janela": "1h", "metrica": "receita", "n": 1}, headers=headers)
+    assert response.json()[0]["codigo"] == "RNK002"
+
+    response = client.get("/relatorios/ranking/", params={"janela": "30d", "ordem": "piores", "n": 100}, headers=headers)
+    assert {"codigo": "RNK003", "unidades": 0, "receita": 0.0} in response.json()
+
+    response = client.get("/relatorios/abc/", params={"janela": "1h", "classe": "A"}, headers=headers)
+    assert response.status_code == 200, f"ABC failed: {response.text}"
+    data = response.json()
+    assert "RNK002" in data["produtos"]
+    assert "RNK003" not in data["produtos"]
+
+    response = client.get("/relatorios/ranking/", params={"janela": "2h"}, headers=headers)
+    assert response.status_code == 400, "Unknown window should fail"
+
+    response = client.get("/relatorios/ranking/", params={"n": 100000}, headers=headers)
+    assert response.status_code == 400, "Oversized n should fail"
+
+    response = client.get("/relatorios/abc/", params={"janela": "1h", "classe": "D"}, headers=headers)
+    assert response.status_code == 400, "Unknown class should fail"
+
+def test_columnar_archive(auth_token, create_product, monkeypatch, tmp_path):
+    from app import arquivo_historico, gerenciador_vendas
+    monkeypatch.setattr(arquivo_historico, "diretorio", str(tmp_path))
+    monkeypatch.setattr(arquivo_historico, "partes", {"vendas": [], "movimentacoes": []})
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    codigo = create_product["codigo"]
+    response = client.post("/vendas/", json={"items": [{"codigo": codigo, "quantidade": 1}]}, headers=headers)
+    assert response.status_code == 200, f"Register sale failed: {response.text}"
+    vendas = client.get("/relatorios/vendas/", headers=headers).json()
+    movimentacoes = client.get("/relatorios/movimentacoes/", headers=headers).json()
+    quantidade = client.get(f"/produtos/{codigo}/estoque", headers=headers).json()["quantidade"]
+
+    corte = datetime.now(timezone.utc)
+    response = client.post("/relatorios/arquivar/", params={"corte": corte.isoformat()}, headers=headers)
+    assert response.status_code == 200, f"Archiving failed: {response.text}"
+    assert response.json()["movimentacoes_arquivadas"] == len(movimentacoes)
+    assert gerenciador_vendas.vendas == [] and gerenciador_vendas.movimentacoes == []
+    assert list(tmp_path.glob("*/*/parte-*.col"))
+
+    # Reports read the archive transparently
+    assert client.get("/relatorios/vendas/", headers=headers).json() == vendas
+    assert client.get("/relatorios/movimentacoes/", headers=headers).json() == movimentacoes
+    recibo = gerenciador_vendas.gerar_recibo(vendas[0]["id_venda"])
+    assert recibo["itens"][0]["codigo"] == vendas[0]["itens"][0]["codigo"]
+    response = client.get(f"/produtos/{codigo}/estoque", params={"em": corte.isoformat()}, headers=headers)
+    assert response.json()["quantidade"] == quantidade
+
+    # Column statistics skip every archived file for a range after the cutoff
+    lidas = []
+    ler_colunas = arquivo_historico._ler_colunas
+    monkeypatch.setattr(arquivo_historico, "_ler_colunas", lambda parte, nomes: lidas.append(parte) or ler_colunas(parte, nomes))
+    response = client.get("/relatorios/movimentacoes/", params={"data_inicio": corte.isoformat()}, headers=headers)
+    assert response.json() == []
+    assert lidas == []
+
+def test_background_archiving_and_restart(auth_token, create_product, monkeypatch, tmp_path):
+    import threading
+    import app as app_module
+    from app import ArquivoHistorico, arquivo_historico, gerenciador_vendas
+    monkeypatch.setattr(arquivo_historico, "diretorio", str(tmp_path))
+    monkeypatch.setattr(arquivo_historico, "partes", {"vendas": [], "movimentacoes": []})
+    codigo = create_product["codigo"]
+    monkeypatch.setattr(app_module, "DIAS_HISTORICO_QUENTE", 0)
+    monkeypatch.setattr(app_module, "INTERVALO_ARQUIVAMENTO_SEGUNDOS", 0)
+    headers = {"Authorization": f"Bearer {auth_token}"}
+
+    # Hold the archive thread while it writes, to check requests are not blocked by it
+    iniciado, liberado = threading.Event(), threading.Event()
+    gravar_parte = arquivo_historico.gravar_parte
+    def gravar_parte_lento(tabela, mes, colunas):
+        iniciado.set()
+        assert liberado.wait(5)
+        return gravar_parte(tabela, mes, colunas)
+    monkeypatch.setattr(arquivo_historico, "gravar_parte", gravar_parte_lento)
+
+    response = client.put(f"/produtos/{codigo}/adicionar", params={"quantidade": 1}, headers=headers)
+    assert response.status_code == 200
+    assert iniciado.wait(5), "Archiving should start in the background"
+    response = client.put(f"/produtos/{codigo}/adicionar", params={"quantidade": 2}, headers=headers)
+    assert response.status_code == 200, "Requests must not wait for the archive"
+    liberado.set()
+    with gerenciador_vendas.lock_arquivamento:
+        pass
+
+    # The movement recorded during archiving stays in memory, after the archived ones
+    assert [m.quantidade for m in gerenciador_vendas.movimentacoes] == [2]
+    response = client.get("/relatorios/movimentacoes/", headers=headers)
+    assert response.headers["content-type"] == "application/json"
+    assert [m["quantidade"] for m in response.json()[-2:]] == [1, 2]
+
+    # Importing the module or building an archive leaves the directory alone;
+    # parts left by a previous run are discarded when the server starts
+    ArquivoHistorico(str(tmp_path))
+    assert list(tmp_path.glob("*/*/parte-*.col"))
+    with TestClient(app):
+        pass
+    assert arquivo_historico.partes == {"vendas": [], "movimentacoes": []}
+    assert not list(tmp_path.glob("*/*/parte-*.col"))
+
+def test_stocktake_rejects_negative_and_split_utf8(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    product_data = {
+        "nome": "Inventory Ç",
+        "codigo": "INVÇ01",
+        "categoria": "Inventory",
+        "quantidade": 5,
+        "preco": 5.0,
+        "descricao": "Product with a multi-byte code.",
+        "fornecedor": "Test Supplier",
+    }
+    response = client.post("/produtos/", json=product_data, headers=headers)
+    assert response.status_code == 200, f"Product creation failed: {response.text}"
+    id_sessao = client.post("/inventarios/", headers=headers).json()["id_sessao"]
+
+    response = client.post(
+        f"/inventarios/{id_sessao}/contagens",
+        content="INVÇ01,-100\n",
+        headers={**headers, "Content-Type": "text/csv"},
+    )
+    assert response.status_code == 400, "Negative count should fail"
+
+    # Drive the ASGI app directly so the body arrives split in the middle of "Ç"
+    import asyncio
+    corpo = "INVÇ01,3\n".encode("utf-8")
+    corte = corpo.index("Ç".encode("utf-8")) + 1
+    mensagens = [
+        {"type": "http.request", "body": corpo[:corte], "more_body": True},
+        {"type": "http.request", "body": corpo[corte:], "more_body": False},
+    ]
+    enviadas = []
+
+    async def receive():
+        return mensagens.pop(0) if mensagens else {"type": "http.disconnect"}
+
+    async def send(mensagem):
+        enviadas.append(mensagem)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": f"/inventarios/{id_sessao}/contagens",
+        "raw_path": f"/inventarios/{id_sessao}/contagens".encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"authorization", f"Bearer {auth_token}".encode()),
+            (b"content-type", b"text/csv"),
+        ],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+    asyncio.run(app(scope, receive, send))
+    assert enviadas[0]["status"] == 200, f"Split UTF-8 count failed: {enviadas}"
+    response = client.post(f"/inventarios/{id_sessao}/fechar", headers=headers)
+    assert response.status_code == 200, f"Close stocktake failed: {response.text}"
+    estoque = client.get("/relatorios/estoque/", headers=headers).json()
+    assert estoque["INVÇ01"]["quantidade"] == 3
+
+def test_export_cache_eviction_removes_files(auth_token, monkeypatch):
+    import os
+    import time
+    import app as app_module
+    monkeypatch.setattr(app_module, "LIMITE_CACHE_EXPORTACOES", 1)
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    jobs = []
+    for formato in ("csv", "json"):
+        response = client.post(
+            "/relatorios/exportacoes/",
+            json={"tipo": "vendas", "formato": formato, "usuario": "nobody"},
+            headers=headers,
+        )
+        assert response.status_code == 200, f"Export submission failed: {response.text}"
+        jobs.append(app_module.gerenciador_exportacoes.obter_job(response.json()["id_job"]))
+    for _ in range(300):
+        if jobs[1].status == "concluido" and not os.path.exists(jobs[0].caminho):
+            break
+        time.sleep(0.1)
+    assert jobs[0].status == "expirado"
+    assert not os.path.exists(jobs[0].caminho)
+    assert jobs[1].status == "concluido"
+    assert os.path.exists(jobs[1].caminho)
+
+def test_invalid_price_does_not_register_product(auth_token):
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    product_data = {
+        "nome": "Bad Price",
+        "codigo": "PRC900",
+        "categoria": "Pricing",
+        "quantidade": 1,
+        "preco": -1.0,
+        "descricao": "Product with an invalid price.",
+        "fornecedor": "Test Supplier",
+    }
+    response = client.post("/produtos/", json=product_data, headers=headers)
+    assert response.status_code == 400, "Negative price should fail"
+    response = client.post("/produtos/", json={**product_data, "preco": 4.0}, headers=headers)
+    assert response.status_code == 200, f"Retry with valid price failed: {response.text}"
+    assert response.json()["preco"] == 4.0
+
+def test_scheduled_price_reaches_stock_report(auth_token):
+    import time
+    from datetime import timedelta
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    product_data = {
+        "nome": "Scheduled Price",
+        "codigo": "PRC901",
+        "categoria": "Pricing",
+        "quantidade": 1,
+        "preco": 4.0,
+        "descricao": "Product with a scheduled price.",
+        "fornecedor": "Test Supplier",
+    }
+    response = client.post("/produtos/", json=product_data, headers=headers)
+    assert response.status_code == 200, f"Product creation failed: {response.text}"
+    vigencia = datetime.now(timezone.utc) + timedelta(seconds=0.5)
+    response = client.put(
+        "/produtos/PRC901/preco",
+        json={"preco": 6.0, "vigencia": vigencia.isoformat()},
+        headers=headers,
+    )
+    assert response.status_code == 200, f"Scheduled price change failed: {response.text}"
+    estoque = client.get("/relatorios/estoque/", headers=headers).json()
+    assert estoque["PRC901"]["preco"] == 4.0
+    time.sleep(max(0.0, (vigencia - datetime.now(timezone.utc)).total_seconds()) + 0.05)
+    estoque = client.get("/relatorios/estoque/", headers=headers).json()
+    assert estoque["PRC901"]["preco"] == 6.0
+
+def test_repricing_does_not_hold_lock_while_building(auth_token, monkeypatch):
+    from app import tabela_precos
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    for codigo in ("PRC910", "PRC911"):
+        product_data = {
+            "nome": f"Concurrent {codigo}",
+            "codigo": codigo,
+            "categoria": "Concurrent Pricing",
+            "quantidade": 1,
+            "preco": 10.0,
+            "descricao": "Product repriced while another price is registered.",
+            "fornecedor": "Test Supplier",
+        }
+        response = client.post("/produtos/", json=product_data, headers=headers)
+        assert response.status_code == 200, f"Product creation failed: {response.text}"
+
+    # A price registered while the new histories are built must neither block nor be lost
+    com_versao = tabela_precos._com_versao
+    registrados = []
+    def com_versao_concorrente(historico, versao, vigencia):
+        if not registrados:
+            assert not tabela_precos.lock.locked()
+            registrados.append(vigencia)
+            tabela_precos.registrar_preco("PRC910", 50.0, datetime(2999, 1, 1, tzinfo=timezone.utc))
+        return com_versao(historico, versao, vigencia)
+    monkeypatch.setattr(tabela_precos, "_com_versao", com_versao_concorrente)
+
+    response = client.post(
+        "/precos/reprecificar",
+        json={"categoria": "Concurrent Pricing", "modo": "absoluto", "valor": 1.0},
+        headers=headers,
+    )
+    assert response.status_code == 200, f"Bulk repricing failed: {response.text}"
+    historico = client.get("/produtos/PRC910/precos", headers=headers).json()
+    assert [versao["preco"] for versao in historico] == [10.0, 11.0, 50.0]
+    estoque = client.get("/relatorios/estoque/", headers=headers).json()
+    assert estoque["PRC911"]["preco"] == 11.0